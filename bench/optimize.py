@@ -0,0 +1,145 @@
+"""
+Benchmark build.optimize: the example project's modules, with a typical
+frame loop module added, emitted as-is and with the optimizer, run through
+lupa against a stub of Löve. Frames are timed by calling love.update and
+love.draw, in LuaJIT 2.1 (as used by Löve) and in Lua 5.4. Both versions
+are timed in alternating rounds and the medians compared, as single runs
+vary by more than the difference.
+
+Usage: python bench/optimize.py [frames] [rounds]
+"""
+from os import path, walk
+from re import sub
+from sys import argv, path as sys_path
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+sys_path.insert(0, path.join(ROOT, 'src'))
+
+from luaparser import ast
+from build import restoreStrings
+from optimize import optimizeTree
+
+DEFINES = {"DEBUG": False}
+
+# A typical frame: entities moved and drawn snapped to pixels, with debug
+# drawing behind a flag
+GAME_LUA = """\
+local entities = {}
+for i = 1, 200 do
+    entities[i] = { x = i * 3.5, y = i * 1.25, vx = 20 + i % 7, vy = 10 - i % 5, r = i / 100 }
+end
+local width, height = 800, 600
+local half_pi = math.pi / 2
+
+function love.update(dt)
+    for i = 1, #entities do
+        local e = entities[i]
+        e.x = (e.x + e.vx * dt) % width
+        e.y = (e.y + e.vy * dt) % height
+        e.r = e.r + math.sin(e.x / 100) * dt
+        if DEBUG then
+            assert(e.x == e.x, "x is NaN")
+        end
+    end
+end
+
+function love.draw()
+    for i = 1, #entities do
+        local e = entities[i]
+        love.graphics.setColor(1, 1, 1, math.min(1, e.r))
+        love.graphics.draw(e, math.floor(e.x + 0.5), math.floor(e.y + 0.5),
+                           e.r * half_pi, 1, 1, 16 / 2, 16 / 2)
+        if DEBUG then
+            love.graphics.print(string.format("%d", i), math.floor(e.x), math.floor(e.y))
+        end
+    end
+end
+"""
+
+LOVE_STUB = """\
+love = { graphics = {} }
+local drawn = 0
+function love.graphics.draw(...) drawn = drawn + 1 end
+function love.graphics.setColor(r, g, b, a) end
+function love.graphics.print(...) end
+package.preload["lfs"] = function() return {} end
+package.preload["zip"] = function() return {} end
+print = function() end
+"""
+
+
+def emit(sources: dict[str, str], optimize: bool) -> dict[str, str]:
+    """
+    Emit the modules the way the build does, with or without the optimizer.
+    """
+    emitted = {}
+    for name, code in sources.items():
+        tree = ast.parse(code)
+        restoreStrings(tree)
+        prelude = optimizeTree(tree, DEFINES) if optimize else ''
+        emitted[name] = prelude + sub(r'\s+\(', '(', ast.to_lua_source(tree))
+    return emitted
+
+
+def timeFrames(runtime, emitted: dict[str, str], frames: int) -> float:
+    """
+    Load the modules into a fresh Lua state and time running frames, in
+    seconds.
+    """
+    lua = runtime()
+    lua.execute(LOVE_STUB)
+    lua.globals().DEBUG = DEFINES["DEBUG"]
+    for name, code in emitted.items():
+        mod = name[:-len('.lua')].replace('/', '.')
+        lua.execute(f'package.preload["{mod}"] = assert(loadstring or load)(...)',
+                    code.encode())
+    lua.execute('require "main" require "game"')
+    run = lua.eval("""function(frames)
+        local start = os.clock()
+        for _ = 1, frames do
+            love.update(1 / 60)
+            love.draw()
+        end
+        return os.clock() - start
+    end""")
+    return run(frames)
+
+
+if __name__ == '__main__':
+    from lupa.luajit21 import LuaRuntime as LuaJIT
+    from lupa.lua54 import LuaRuntime as Lua54
+
+    from statistics import median
+
+    frames = int(argv[1]) if len(argv) > 1 else 2000
+    rounds = int(argv[2]) if len(argv) > 2 else 9
+
+    sources = {}
+    src_dir = path.join(ROOT, 'example', 'src')
+    for dir_path, _, files in walk(src_dir):
+        for file in sorted(files):
+            if file.endswith('.lua'):
+                with open(path.join(dir_path, file), 'r') as src_file:
+                    name = path.relpath(path.join(dir_path, file), src_dir)
+                    sources[name.replace(path.sep, '/')] = src_file.read()
+    sources["game.lua"] = GAME_LUA
+
+    plain = emit(sources, False)
+    optimized = emit(sources, True)
+    print(f'{len(sources)} modules, {frames} frames of 200 entities,',
+          f'median of {rounds} rounds')
+
+    for label, runtime in [('LuaJIT 2.1', LuaJIT), ('Lua 5.4', Lua54)]:
+        plain_times = []
+        optimized_times = []
+        for _ in range(rounds):
+            plain_times.append(timeFrames(runtime, plain, frames))
+            optimized_times.append(timeFrames(runtime, optimized, frames))
+        plain_time = median(plain_times)
+        optimized_time = median(optimized_times)
+        ratios = sorted(p / o for p, o in zip(plain_times, optimized_times))
+        print(f'{label}:')
+        print(f'  as-is:     {plain_time * 1000:9.2f} ms')
+        print(f'  optimized: {optimized_time * 1000:9.2f} ms')
+        print(f'  speedup:   {plain_time / optimized_time:9.2f}x',
+              f'(rounds {ratios[0]:.2f}-{ratios[-1]:.2f}x)')
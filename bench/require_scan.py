@@ -0,0 +1,67 @@
+"""
+Benchmark require discovery: the lightweight scanner against a full
+luaparser parse and ast.walk, on the example project scaled up.
+
+Usage: python bench/require_scan.py [copies]
+"""
+from os import path, walk
+from sys import argv, path as sys_path
+from time import perf_counter
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+sys_path.insert(0, path.join(ROOT, 'src'))
+
+from luaparser import ast, astnodes
+from scanner import scanRequires
+
+
+def loadExample(copies: int) -> list[str]:
+    """
+    Read the example project's Lua files, repeated to the given scale.
+    """
+    sources = []
+    for dir_path, _, files in walk(path.join(ROOT, 'example', 'src')):
+        for file in sorted(files):
+            if file.endswith('.lua'):
+                with open(path.join(dir_path, file), 'r') as src_file:
+                    sources.append(src_file.read())
+    return sources * copies
+
+
+def astRequires(lua_code: str) -> list[str]:
+    """
+    Find requires the way the build did before the scanner.
+    """
+    requires = []
+    for node in ast.walk(ast.parse(lua_code)): # type: ignore
+        if isinstance(node, astnodes.Call) and isinstance(node.func, astnodes.Name)\
+                and node.func.id == 'require':
+            requires.append(node.args[0].s) # type: ignore
+    return requires
+
+
+def timeIt(fn, sources: list[str]) -> float:
+    """
+    Time one pass of fn over every source.
+    """
+    start = perf_counter()
+    for source in sources:
+        fn(source)
+    return perf_counter() - start
+
+
+if __name__ == '__main__':
+    copies = int(argv[1]) if len(argv) > 1 else 200
+    sources = loadExample(copies)
+    size = sum(len(source) for source in sources)
+    print(f'{len(sources)} files, {size / 1024:.1f} KiB of Lua')
+
+    for source in set(sources):
+        assert scanRequires(source)[0] == list(dict.fromkeys(astRequires(source)))
+
+    scan_time = timeIt(scanRequires, sources)
+    ast_time = timeIt(astRequires, sources)
+
+    print(f'scanner:       {scan_time * 1000:9.2f} ms')
+    print(f'ast.walk:      {ast_time * 1000:9.2f} ms')
+    print(f'speedup:       {ast_time / scan_time:9.1f}x')
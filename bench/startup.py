@@ -0,0 +1,78 @@
+"""
+Benchmark module load time at startup: the example project's emitted Lua
+source against its build.bytecode output, loaded in LuaJIT 2.1 (as used by
+Löve) through lupa. Only loading is timed, i.e. what require does before
+running a module.
+
+Usage: python bench/startup.py [copies]
+"""
+from os import path, walk
+from sys import argv, path as sys_path
+from tempfile import TemporaryDirectory
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+sys_path.insert(0, path.join(ROOT, 'src'))
+
+from lupa.luajit21 import LuaRuntime
+from luaparser import ast
+import bytecode
+
+
+def emitExample() -> dict[str, str]:
+    """
+    Emit the example project's Lua files the way the build does, keyed by
+    their path in the build directory.
+    """
+    from re import sub
+
+    emitted = {}
+    src_dir = path.join(ROOT, 'example', 'src')
+    for dir_path, _, files in walk(src_dir):
+        for file in sorted(files):
+            if file.endswith('.lua'):
+                with open(path.join(dir_path, file), 'r') as src_file:
+                    tree = ast.parse(src_file.read())
+                chunk_name = path.relpath(path.join(dir_path, file), src_dir)
+                emitted[chunk_name] = sub(r'\s+\(', '(', ast.to_lua_source(tree))
+    return emitted
+
+
+def timeLoads(lua, chunks: list[tuple[bytes, bytes]], copies: int) -> float:
+    """
+    Time loading every chunk copies times, in seconds.
+    """
+    load_all = lua.eval(b"""function(chunks, copies)
+        local start = os.clock()
+        for _ = 1, copies do
+            for i = 1, #chunks do
+                assert(loadstring(chunks[i][1], chunks[i][2]))
+            end
+        end
+        return os.clock() - start
+    end""")
+    table = lua.table_from([lua.table_from(chunk) for chunk in chunks])
+    return load_all(table, copies)
+
+
+if __name__ == '__main__':
+    copies = int(argv[1]) if len(argv) > 1 else 2000
+    emitted = emitExample()
+
+    with TemporaryDirectory() as tmp_dir:
+        bytecode.cache_dir = tmp_dir
+        source = [(code.encode(), f"@{name}".encode()) for name, code in emitted.items()]
+        compiled = [(bytecode.compileBytecode(code, name, 'lupa:luajit21'), f"@{name}".encode())
+                    for name, code in emitted.items()]
+
+    lua = LuaRuntime(encoding=None)
+    source_size = sum(len(code) for code, _ in source)
+    compiled_size = sum(len(code) for code, _ in compiled)
+    print(f'{len(source)} modules loaded {copies} times,',
+          f'{source_size} B of source, {compiled_size} B of bytecode')
+
+    source_time = timeLoads(lua, source, copies)
+    compiled_time = timeLoads(lua, compiled, copies)
+
+    print(f'source:        {source_time * 1000:9.2f} ms')
+    print(f'bytecode:      {compiled_time * 1000:9.2f} ms')
+    print(f'speedup:       {source_time / compiled_time:9.1f}x')
@@ -0,0 +1,214 @@
+# Asset functions
+
+asset_modes = ["copy", "hardlink", "reflink"]
+
+
+def globToRegex(pattern: str) -> str:
+    """
+    Translate a build.include/build.exclude pattern into a regex over paths
+    relative to the source directory, with directories given a trailing `/`.
+
+    Patterns without a `/` match a name at any depth, otherwise they are
+    anchored to the source directory. `*` and `?` do not cross directories,
+    `**` does, and a trailing `/` matches a directory and everything in it.
+    """
+    from re import escape
+
+    anchored = '/' in pattern.rstrip('/')
+    dir_only = pattern.endswith('/')
+    glob = pattern.strip('/')
+
+    regex = '' if anchored else '(?:.*/)?'
+    i = 0
+    while i < len(glob):
+        if glob.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+        elif glob.startswith('**', i):
+            regex += '.*'
+            i += 2
+        elif glob[i] == '*':
+            regex += '[^/]*'
+            i += 1
+        elif glob[i] == '?':
+            regex += '[^/]'
+            i += 1
+        elif glob[i] == '[' and ']' in glob[i+2:]:
+            end = glob.index(']', i+2)
+            chars = glob[i+1:end]
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+            regex += '[' + chars.replace('\\', '\\\\') + ']'
+            i = end + 1
+        else:
+            regex += escape(glob[i])
+            i += 1
+
+    return regex + ('/.*' if dir_only else '/?')
+
+
+def compilePatterns(patterns: list[str]):
+    """
+    Compile a list of patterns into a single regex, or None if it is empty.
+    """
+    from re import compile
+
+    if len(patterns) == 0:
+        return None
+    return compile('(?:' + '|'.join(globToRegex(p) for p in patterns) + ')$')
+
+
+def findAssets(source_dir: str, include: list[str],
+               exclude: list[str]) -> dict:
+    """
+    Find the assets in the source directory matching build.include and not
+    build.exclude, in a single pass. Excluded directories are not descended
+    into, and symlinked directories are only visited once. Returns the stat
+    result of each asset, keyed by its path relative to the source directory.
+    """
+    from os import scandir, stat
+
+    included = compilePatterns(include)
+    excluded = compilePatterns(exclude)
+    assets = {}
+
+    if included is None:
+        return assets
+
+    to_visit = ['']
+    visited: set[tuple[int, int]] = set()
+    while len(to_visit) > 0:
+        rel_dir = to_visit.pop()
+        st = stat(f"./{source_dir}/{rel_dir}")
+        if (st.st_dev, st.st_ino) in visited:
+            continue
+        visited.add((st.st_dev, st.st_ino))
+        with scandir(f"./{source_dir}/{rel_dir}") as entries:
+            for entry in entries:
+                rel_path = f"{rel_dir}{entry.name}"
+                if entry.is_dir():
+                    if excluded is None or not excluded.match(f"{rel_path}/"):
+                        to_visit.append(f"{rel_path}/")
+                elif included.match(rel_path) and\
+                        (excluded is None or not excluded.match(rel_path)):
+                    assets[rel_path] = entry.stat()
+
+    return {rel_path: assets[rel_path] for rel_path in sorted(assets)}
+
+
+def reflinkFile(src_path: str, dest_path: str):
+    """
+    Create a copy-on-write clone of a file. Raises OSError where the
+    platform or file system does not support it.
+    """
+    try:
+        from fcntl import ioctl
+    except ImportError:
+        raise OSError('reflinks are not supported on this platform')
+
+    FICLONE = 0x40049409
+    with open(src_path, 'rb') as src, open(dest_path, 'wb') as dest:
+        ioctl(dest.fileno(), FICLONE, src.fileno())
+
+
+def placeAsset(src_path: str, dest_path: str, mode: str) -> str:
+    """
+    Place an asset in the build directory by copy, hardlink or reflink,
+    falling back to a copy when a link cannot be made. Returns the mode that
+    was used.
+    """
+    from os import link, makedirs, path, remove, replace
+    from shutil import copyfile
+
+    makedirs(path.dirname(dest_path), exist_ok=True)
+    tmp_path = f"{dest_path}.amor-tmp"
+    if path.exists(tmp_path):
+        remove(tmp_path)
+
+    used = mode
+    try:
+        if mode == 'hardlink':
+            link(src_path, tmp_path)
+        elif mode == 'reflink':
+            reflinkFile(src_path, tmp_path)
+        else:
+            copyfile(src_path, tmp_path)
+    except OSError:
+        if mode == 'copy':
+            raise
+        if path.exists(tmp_path):
+            remove(tmp_path)
+        copyfile(src_path, tmp_path)
+        used = 'copy'
+
+    replace(tmp_path, dest_path)
+    return used
+
+
+def syncAssets(assets: dict, source_dir: str, build_dir: str,
+               records: dict[str, dict], mode: str = 'copy',
+               use_hash: bool = False) -> dict[str, dict]:
+    """
+    Bring the assets in the build directory in line with the source.
+
+    Assets are given as the output of findAssets. Only assets
+    whose size, mtime or (with use_hash) content differ from their manifest
+    record are placed again, in a thread pool. Assets that have a record but
+    are no longer in the list are removed from the build directory. Returns
+    the updated records.
+    """
+    from os import path, remove, rmdir, listdir
+    from concurrent.futures import ThreadPoolExecutor
+    from manifest import hashFile
+
+    def syncAsset(rel_path: str):
+        src_path = f"./{source_dir}/{rel_path}"
+        dest_path = f"./{build_dir}/{rel_path}"
+        st = assets[rel_path]
+        record = records.get(rel_path)
+
+        current = record is not None and record["mode"] == mode\
+                and record["size"] == st.st_size and path.exists(dest_path)
+        if current and record["mtime"] == st.st_mtime_ns:
+            return record, None
+        if current and use_hash and record.get("hash") == hashFile(src_path):
+            return {**record, "mtime": st.st_mtime_ns}, None
+
+        used = placeAsset(src_path, dest_path, mode)
+        return {
+                "size": st.st_size,
+                "mtime": st.st_mtime_ns,
+                "mode": mode,
+                "hash": hashFile(src_path) if use_hash else None,
+                }, used
+
+    synced: dict[str, dict] = {}
+    placed = 0
+    with ThreadPoolExecutor() as pool:
+        results = pool.map(syncAsset, assets.keys())
+        for rel_path, (record, used) in zip(assets, results):
+            synced[rel_path] = record
+            if used is not None:
+                placed += 1
+                print(f"Copied ./{source_dir}/{rel_path}" if used == 'copy'
+                      else f"Linked ./{source_dir}/{rel_path} ({used})")
+
+    removed = 0
+    for rel_path in records:
+        if rel_path in synced:
+            continue
+        dest_path = f"./{build_dir}/{rel_path}"
+        if path.exists(dest_path):
+            remove(dest_path)
+            print(f"Removed {dest_path}")
+        removed += 1
+        # Clear directories left empty, up to the build directory
+        parent = path.dirname(dest_path)
+        while parent != f"./{build_dir}" and path.isdir(parent)\
+                and len(listdir(parent)) == 0:
+            rmdir(parent)
+            parent = path.dirname(parent)
+
+    print(f"Assets: {placed} updated, {len(assets) - placed} unchanged,",
+          f"{removed} removed")
+    return synced
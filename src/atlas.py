@@ -0,0 +1,251 @@
+# Texture atlas packing
+
+atlas_module_lua = """\
+-- Generated by amor from the "{name}" atlas, do not edit
+local pages = {{
+{pages}}}
+local rects = {{
+{rects}}}
+
+local images = {{}}
+local quads = {{}}
+
+local atlas = {{ pages = pages, rects = rects }}
+
+-- The Image of an atlas page, loaded on first use
+function atlas.image(page)
+    if not images[page] then
+        images[page] = love.graphics.newImage(pages[page])
+    end
+    return images[page]
+end
+
+-- The atlas Image and Quad for an original image path, or nil if it is not
+-- in the atlas
+function atlas.get(path)
+    local rect = rects[path]
+    if not rect then return nil end
+    local image = atlas.image(rect[1])
+    if not quads[path] then
+        quads[path] = love.graphics.newQuad(rect[2], rect[3], rect[4], rect[5],
+                                            image:getDimensions())
+    end
+    return image, quads[path]
+end
+
+-- Draw an original image from the atlas, as love.graphics.draw would
+function atlas.draw(path, ...)
+    local image, quad = atlas.get(path)
+    return love.graphics.draw(image, quad, ...)
+end
+
+return atlas
+"""
+
+
+def packRects(sizes: list[tuple[int, int]], width: int,
+              height: int) -> list[tuple[int, int] | None]:
+    """
+    Place rectangles in a width by height bin with the MaxRects algorithm,
+    best short side fit, in the order given. Returns the position of each
+    rectangle, or None for those that did not fit.
+    """
+    free = [(0, 0, width, height)]
+    placed: list[tuple[int, int] | None] = []
+
+    for w, h in sizes:
+        best = None
+        best_score = (width + height, width + height)
+        for fx, fy, fw, fh in free:
+            if w <= fw and h <= fh:
+                score = (min(fw - w, fh - h), max(fw - w, fh - h))
+                if score < best_score:
+                    best = (fx, fy)
+                    best_score = score
+        placed.append(best)
+        if best is None:
+            continue
+
+        # Split every free rectangle the new one overlaps into the maximal
+        # free rectangles around it
+        x, y = best
+        split = []
+        for fx, fy, fw, fh in free:
+            if x >= fx + fw or x + w <= fx or y >= fy + fh or y + h <= fy:
+                split.append((fx, fy, fw, fh))
+                continue
+            if x > fx:
+                split.append((fx, fy, x - fx, fh))
+            if x + w < fx + fw:
+                split.append((x + w, fy, fx + fw - x - w, fh))
+            if y > fy:
+                split.append((fx, fy, fw, y - fy))
+            if y + h < fy + fh:
+                split.append((fx, y + h, fw, fy + fh - y - h))
+
+        # Drop free rectangles contained in others
+        free = [r for i, r in enumerate(split)
+                if not any(i != j and o[0] <= r[0] and o[1] <= r[1]
+                           and o[0] + o[2] >= r[0] + r[2] and o[1] + o[3] >= r[1] + r[3]
+                           and (o != r or j < i)
+                           for j, o in enumerate(split))]
+
+    return placed
+
+
+def packAtlas(sizes: list[tuple[int, int]], max_size: int,
+              padding: int) -> list[tuple[int, int, dict[int, tuple[int, int]]]]:
+    """
+    Pack images into as few power-of-two pages as fit within max_size. Each
+    image is given padding on every side. Returns the width, height and the
+    position of each image, by index, of every page. Images that cannot fit
+    on a page are left out.
+    """
+    order = sorted(range(len(sizes)), key=lambda i: (max(sizes[i]), sizes[i]),
+                   reverse=True)
+    order = [i for i in order if sizes[i][0] + 2 * padding <= max_size
+             and sizes[i][1] + 2 * padding <= max_size]
+    pages = []
+
+    while len(order) > 0:
+        padded = [(sizes[i][0] + 2 * padding, sizes[i][1] + 2 * padding) for i in order]
+        area = sum(w * h for w, h in padded)
+
+        # The smallest power-of-two square that could hold everything left
+        size = 1
+        while size * size < area and size < max_size:
+            size *= 2
+        while True:
+            placed = packRects(padded, size, size)
+            if all(p is not None for p in placed) or size >= max_size:
+                break
+            size *= 2
+
+        positions = {i: (p[0] + padding, p[1] + padding)
+                     for i, p in zip(order, placed) if p is not None}
+        if len(positions) == 0:
+            break
+
+        # Trim unused space, keeping power-of-two sides
+        used_w = max(positions[i][0] + sizes[i][0] + padding for i in positions)
+        used_h = max(positions[i][1] + sizes[i][1] + padding for i in positions)
+        width = height = size
+        while width // 2 >= used_w:
+            width //= 2
+        while height // 2 >= used_h:
+            height //= 2
+
+        pages.append((width, height, positions))
+        order = [i for i in order if i not in positions]
+
+    return pages
+
+
+def syncAtlases(atlases: dict[str, dict], assets: dict, source_dir: str,
+                build_dir: str, records: dict[str, dict], submit,
+                module_dir: str | None = None) -> tuple[dict, dict]:
+    """
+    Pack the PNG assets matching each [atlas.<name>] include patterns into
+    the pages of that atlas, with a Lua module `atlas.<name>` mapping each
+    original path to its page and rectangle. Atlases whose configuration and
+    input hashes match their record are not packed again. submit runs image
+    decoding, e.g. in the build's worker pool. The modules are written to
+    module_dir if given, e.g. to be bundled, and next to the pages otherwise.
+
+    Returns the assets left to copy, without the packed images, and the
+    updated records.
+    """
+    from os import path, makedirs, remove, rmdir, listdir
+    from json import dumps
+    from assets import compilePatterns
+    from manifest import hashContent, hashFile
+    from png import readPNG, writePNG
+    from utils import write_if_changed
+    from bundle import luaString
+
+    out_dir = f"./{build_dir}/atlas"
+    module_dir = module_dir or out_dir
+    remaining = dict(assets)
+    synced: dict[str, dict] = {}
+
+    for name, atlas_conf in sorted(atlases.items()):
+        patterns = compilePatterns(atlas_conf.get("include", []))
+        max_size = atlas_conf.get("max_size", 2048)
+        padding = atlas_conf.get("padding", 1)
+        inputs = [rel_path for rel_path in remaining if rel_path.lower().endswith('.png')
+                  and patterns is not None and patterns.match(rel_path)]
+
+        key = hashContent(dumps([atlas_conf, module_dir, [
+                (rel_path, hashFile(f"./{source_dir}/{rel_path}")) for rel_path in inputs
+                ]], sort_keys=True).encode())
+        record = records.get(name)
+        if record is not None and record["key"] == key\
+                and all(path.exists(out) for out in record["outputs"]):
+            print(f'Atlas {name} unchanged')
+            for rel_path in record["packed"]:
+                del remaining[rel_path]
+            synced[name] = record
+            continue
+
+        images = {}
+        for rel_path, fut in [(rel_path, submit(readPNG, f"./{source_dir}/{rel_path}"))
+                              for rel_path in inputs]:
+            try:
+                images[rel_path] = fut.result()
+            except ValueError as err:
+                print(f'Not packing {rel_path} into atlas {name}: {err}')
+
+        packed_paths = list(images)
+        pages = packAtlas([images[p][:2] for p in packed_paths], max_size, padding)
+
+        makedirs(out_dir, exist_ok=True)
+        outputs: list[str] = []
+        page_lines: list[str] = []
+        rect_lines: list[str] = []
+        packed: list[str] = []
+        for page, (width, height, positions) in enumerate(pages, start=1):
+            canvas = bytearray(width * height * 4)
+            for i, (x, y) in sorted(positions.items()):
+                w, h, pixels = images[packed_paths[i]]
+                for row in range(h):
+                    start = ((y + row) * width + x) * 4
+                    canvas[start:start + w * 4] = pixels[row * w * 4:(row + 1) * w * 4]
+                quoted = luaString(packed_paths[i].encode(), long=False)
+                rect_lines.append(f'    [{quoted}] = {{ {page}, {x}, {y}, {w}, {h} }},\n')
+                packed.append(packed_paths[i])
+
+            page_path = f"{out_dir}/{name}_{page}.png"
+            writePNG(page_path, width, height, canvas)
+            outputs.append(page_path)
+            page_lines.append(f'    {luaString(f"atlas/{name}_{page}.png".encode(), long=False)},\n')
+            print(f'Packed {len(positions)} images into {page_path} ({width}x{height})')
+
+        for rel_path in packed_paths:
+            if rel_path not in packed:
+                print(f'{rel_path} is too large for atlas {name}')
+
+        makedirs(module_dir, exist_ok=True)
+        module_path = f"{module_dir}/{name}.lua"
+        write_if_changed(module_path, atlas_module_lua.format(
+                name=name, pages=''.join(page_lines), rects=''.join(sorted(rect_lines))))
+        outputs.append(module_path)
+
+        if record is not None:
+            for out in record["outputs"]:
+                if out not in outputs and path.exists(out):
+                    remove(out)
+        for rel_path in packed:
+            del remaining[rel_path]
+        synced[name] = {"key": key, "outputs": outputs, "packed": sorted(packed)}
+
+    for name, record in records.items():
+        if name not in synced:
+            for out in record["outputs"]:
+                if path.exists(out):
+                    remove(out)
+            print(f'Removed atlas {name}')
+    for empty_dir in {out_dir, module_dir}:
+        if len(synced) == 0 and path.isdir(empty_dir) and len(listdir(empty_dir)) == 0:
+            rmdir(empty_dir)
+
+    return remaining, synced
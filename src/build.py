@@ -1,227 +1,800 @@
 from argparse import Namespace
+from typing import TYPE_CHECKING
 
-def buildOpt(args: Namespace):
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+    from graph import ModuleGraph
+
+def rewriteRequires(tree, renames: dict[str, str]):
     """
-    Build the project.
+    Rename the modules required in an AST, in place. Only require calls whose
+    argument exactly matches a key of renames are changed.
+    """
+    from luaparser import ast, astnodes
+    from constants import lazy_require_fn
+
+    for node in ast.walk(tree): # type: ignore
+        if isinstance(node, astnodes.Call) and isinstance(node.func, astnodes.Name)\
+                and node.func.id in ('require', lazy_require_fn) and len(node.args) > 0:
+            mod = node.args[0]
+            if isinstance(mod, astnodes.String) and mod.s in renames:
+                mod.s = renames[mod.s]
+    return
+
+
+def lazyRequires(tree, lazy: set[str]) -> tuple[list[str], list[str]]:
+    """
+    Turn top-level `local x = require("mod")` statements for the modules in
+    lazy into lazy proxies, in place. The proxy only stands in for the module
+    when indexed or called, as LuaJIT ignores __len and __pairs, so requires
+    whose local is used any other way in the file are kept. Returns the
+    modules made lazy, and the ones kept with why.
+    """
+    from luaparser import ast, astnodes
+    from constants import lazy_require_fn
+
+    # Names the proxy handles, and names that are not variables at all
+    proxied: set[int] = set()
+    not_variables: set[int] = set()
+    for node in ast.walk(tree): # type: ignore
+        if isinstance(node, astnodes.Index):
+            proxied.add(id(node.value))
+            if node.notation == astnodes.IndexNotation.DOT:
+                not_variables.add(id(node.idx))
+        elif isinstance(node, astnodes.Invoke):
+            proxied.add(id(node.source))
+            not_variables.add(id(node.func))
+        elif isinstance(node, astnodes.Method):
+            proxied.add(id(node.source))
+            not_variables.add(id(node.name))
+        elif isinstance(node, astnodes.Call):
+            proxied.add(id(node.func))
+        elif isinstance(node, astnodes.Field) and not node.between_brackets:
+            not_variables.add(id(node.key))
+        elif isinstance(node, astnodes.Goto):
+            not_variables.add(id(node.label))
+        elif isinstance(node, astnodes.Label):
+            not_variables.add(id(node.id))
+
+    def otherUse(target) -> str | None:
+        for node in ast.walk(tree): # type: ignore
+            if isinstance(node, astnodes.Name) and node.id == target.id\
+                    and node is not target and id(node) not in proxied\
+                    and id(node) not in not_variables:
+                line = getattr(getattr(node, '_first_token', None), 'line', None)
+                return f"{target.id} is used other than by indexing or calling it"\
+                        + (f" on line {line}" if line is not None else "")
+        return None
+
+    lazied: list[str] = []
+    kept: list[str] = []
+    for node in tree.body.body:
+        if not isinstance(node, astnodes.LocalAssign) or len(node.targets) != 1\
+                or len(node.values) != 1:
+            continue
+        call = node.values[0]
+        if isinstance(call, astnodes.Call) and isinstance(call.func, astnodes.Name)\
+                and call.func.id == 'require' and len(call.args) == 1\
+                and isinstance(call.args[0], astnodes.String) and call.args[0].s in lazy:
+            reason = otherUse(node.targets[0])
+            if reason is not None:
+                kept.append(f"{call.args[0].s} ({reason})")
+                continue
+            call.func.id = lazy_require_fn
+            if call.args[0].s not in lazied:
+                lazied.append(call.args[0].s)
+    return lazied, kept
+
+
+def assetReferences(tree) -> tuple[list[str], list[int]]:
+    """
+    Find the asset paths an AST may reference: every string literal that
+    looks like a file name, so paths kept in tables count too. Also returns
+    the lines of asset loader calls (see constants.asset_loaders) whose path
+    is not a literal.
     """
-    from toml import load
-    from os import path, mkdir, listdir
+    from os import path
     from luaparser import ast, astnodes
-    from pickle import load as pload, dump as pdump
-    from shutil import rmtree, copytree, copyfile
-    from fnmatch import fnmatch
+    from constants import asset_loaders
+
+    refs: set[str] = set()
+    dynamic: list[int] = []
+    for node in ast.walk(tree): # type: ignore
+        if isinstance(node, astnodes.String):
+            if len(node.s) <= 256 and '\n' not in node.s and path.splitext(node.s)[1] != '':
+                ref = node.s[2:] if node.s.startswith('./') else node.s
+                refs.add(ref.lstrip('/'))
+        elif isinstance(node, (astnodes.Call, astnodes.Invoke)):
+            name = node.func.idx if isinstance(node.func, astnodes.Index) else node.func
+            if isinstance(name, astnodes.Name) and name.id in asset_loaders\
+                    and len(node.args) > 0 and not isinstance(node.args[0], astnodes.String):
+                token = getattr(node, '_first_token', None)
+                dynamic.append(getattr(token, 'line', 0))
+    return sorted(refs), sorted(set(dynamic))
+
+
+def restoreStrings(tree):
+    """
+    Put the original source text back into the string literals of an AST,
+    in place. The parser unescapes quoted strings, which would be emitted
+    unescaped, and gives long strings with `=` levels plain quotes, which
+    are emitted as quoted strings whatever their content.
+    """
+    from luaparser import ast, astnodes
+    from bundle import luaString
+
+    for node in ast.walk(tree): # type: ignore
+        token = getattr(node, '_first_token', None)
+        if not isinstance(node, astnodes.String) or token is None:
+            continue
+        text = token.text
+        if text[0] in ('"', "'"):
+            node.s = text[1:-1]
+            node.delimiter = astnodes.StringDelimiter.DOUBLE_QUOTE if text[0] == '"'\
+                else astnodes.StringDelimiter.SINGLE_QUOTE
+        elif text.startswith('[='):
+            level = text.index('[', 1) + 1
+            content = text[level:-level]
+            if content.startswith('\r\n') or content.startswith('\n\r'):
+                content = content[2:]
+            elif content[:1] in ('\n', '\r'):
+                content = content[1:]
+            node.s = luaString(content.encode(), long=False)[1:-1]
+            node.delimiter = astnodes.StringDelimiter.DOUBLE_QUOTE
+    return
+
+
+def separateMinus(tree):
+    """
+    Parenthesize the operand of a unary minus that is itself negated, in
+    place, as the emitter writes `- -x` as `--x`, which is a comment.
+    """
+    from luaparser import ast, astnodes
+
+    for node in ast.walk(tree): # type: ignore
+        if isinstance(node, astnodes.UMinusOp) and isinstance(node.operand, astnodes.UMinusOp):
+            node.operand.wrapped = True
+    return
+
+
+def compileFile(lua_code: str, comp_path: str, renames: dict[str, str],
+                prelude: str = '', bytecode: str | None = None,
+                chunk_name: str = '', lazy: set[str] = set(),
+                optimize: dict | None = None) -> tuple[str, list[str], list[str],
+                                                       list[str], list[int]]:
+    """
+    Parse Lua source, turn top-level requires of the modules in lazy into
+    lazy proxies, point external requires at ext/, optionally optimize it
+    with the build.optimize settings, and emit it to the build directory,
+    after prelude. With a bytecode target, the emitted source is precompiled
+    as chunk_name. Returns the output path, the modules made lazy and kept
+    eager (see lazyRequires), and the asset references found by
+    assetReferences. Run in a worker process by
+    buildOpt.
+    """
+    from os import makedirs, path
+    from luaparser import ast
     from re import sub
-    try:
-        from lupa.lua54 import LuaRuntime
-    except ImportError:
+    from bytecode import compileBytecode
+    from constants import lazy_require_lua
+    from optimize import optimizeTree
+
+    tree = ast.parse(lua_code)
+    restoreStrings(tree)
+    separateMinus(tree)
+
+    asset_refs, asset_dynamic = assetReferences(tree)
+    lazied, kept = lazyRequires(tree, lazy) if len(lazy) > 0 else ([], [])
+    rewriteRequires(tree, renames)
+    if optimize is not None:
+        # conf.lua runs before Löve's modules are loaded
+        prelude += optimizeTree(tree, optimize["defines"],
+                                optimize["hoist"] and chunk_name != 'conf.lua')
+
+    comped = ast.to_lua_source(tree)
+
+    if len(lazied) > 0:
+        prelude += lazy_require_lua
+    comped = prelude + sub(r'\s+\(', '(', comped)
+
+    makedirs(path.dirname(comp_path), exist_ok=True)
+    if bytecode is not None:
+        with open(comp_path, 'wb') as out:
+            out.write(compileBytecode(comped, chunk_name, bytecode))
+    else:
+        with open(comp_path, 'w') as out:
+            out.write(comped)
+
+    return comp_path, lazied, kept, asset_refs, asset_dynamic
+
+
+def plainTable(value):
+    """
+    Copy a table loaded from amor.toml into plain dicts and lists. Inline
+    tables load as a class local to the toml decoder, which cannot be
+    pickled for the build worker processes.
+    """
+    if isinstance(value, dict):
+        return {key: plainTable(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [plainTable(item) for item in value]
+    return value
+
+
+class Builder:
+    """
+    The build pipeline for a project. Keeps the configuration, module
+    resolver, module graph and build manifest between builds so that
+    `build --watch` only redoes the work a change affects.
+    """
+
+    def __init__(self, args: Namespace):
+        from os import cpu_count
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.args = args
+        self.graph = None
+        self.manifest: dict = {}
+        self.ambiguous: set[str] = set()
+        # Inject the hot-swap agent used by `amor dev` into the entry file
+        self.agent = False
+        # Emit modules to .bld/ and bundle them into the entry file
+        self.bundle = args.bundle
+
+        jobs = args.jobs if args.jobs > 0 else (cpu_count() or 1)
+        self.pool = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+
+
+    def load(self) -> bool:
+        """
+        Load amor.toml and index the module search path. Returns False if
+        the configuration is invalid.
+        """
+        from toml import load
+        from os import path, mkdir
         try:
-            from lupa.lua53 import LuaRuntime
+            from lupa.lua54 import LuaRuntime
         except ImportError:
             try:
-                from lupa.lua52 import LuaRuntime
+                from lupa.lua53 import LuaRuntime
             except ImportError:
-                from lupa.lua51 import LuaRuntime
+                try:
+                    from lupa.lua52 import LuaRuntime
+                except ImportError:
+                    from lupa.lua51 import LuaRuntime
+
+        from manifest import loadManifest
+        from assets import asset_modes, compilePatterns
+        from bytecode import bytecodeTarget, checkTarget
+        from constants import unused_asset_modes
+
+        with open('amor.toml', 'r') as conf_file:
+            conf = load(conf_file)
+
+        asset_mode = conf["build"].get("asset_mode", "copy")
+        if asset_mode not in asset_modes:
+            print(f'Unknown build.asset_mode "{asset_mode}", expected one of',
+                  *asset_modes)
+            return False
+
+        unused_assets = conf["build"].get("unused_assets", "keep")
+        if unused_assets not in unused_asset_modes:
+            print(f'Unknown build.unused_assets "{unused_assets}", expected one of',
+                  *unused_asset_modes)
+            return False
+
+        bytecode = bytecodeTarget(conf["build"])
+        if bytecode is not None and not checkTarget(bytecode):
+            return False
+
+        self.conf = conf
+        self.source_dir = conf["project"]["source_dir"]
+        self.build_dir = conf["project"]["build_dir"]
+        self.entry = conf["project"]["entry"]
+        self.include = conf["build"]["include"]
+        self.exclude = conf["build"].get("exclude", [])
+        self.asset_mode = asset_mode
+        self.asset_hash = conf["build"].get("asset_hash", False)
+        self.bytecode = bytecode
+        # build.lazy entries with a `/` match file paths, others module names
+        lazy = conf["build"].get("lazy", [])
+        self.lazy_names = [p for p in lazy if '/' not in p]
+        self.lazy_paths = compilePatterns([p for p in lazy if '/' in p])
+        self.unused_assets = unused_assets
+        self.atlases = conf.get("atlas", {})
+        self.transforms = conf.get("transform", [])
+        # Modules generated into the build rather than resolved
+        self.generated = {f"atlas.{name}" for name in self.atlases}
+        self.asset_keep = conf["build"].get("asset_keep", [])
+        self.optimize = {
+                "defines": plainTable(conf["build"].get("defines", {})),
+                "hoist": conf["build"].get("hoist", True),
+                } if conf["build"].get("optimize", False) else None
+
+        lua = LuaRuntime()
+
+        lpath = lua.eval('package.path')
+        cpath = lua.eval('package.cpath')
+        self.lua_path = f'./.amor/?.lua;./{self.source_dir}/?.lua;./.amor/?/init.lua;{str(lpath)};'
+        self.lua_cpath = f';./.amor/?.so;./.amor/?/?.so;./{self.source_dir}/?.so;{str(cpath)};'
+        self.indexModules()
+
+        if not path.exists('./.bld'):
+            mkdir('./.bld')
+
+        self.manifest_path = './.bld/manifest.json'
+        self.manifest = loadManifest(self.manifest_path)
+        self.graph = None
+        return True
+
+
+    def indexModules(self):
+        """
+        Rebuild the module resolver, e.g. after files were added or removed.
+        """
+        from resolver import ModuleResolver
+        self.resolver = ModuleResolver(self.lua_path+self.lua_cpath,
+                                       [f'./{self.build_dir}'])
+
 
-    from constants import init_lua_template_so, init_lua_template_lua, love_builtins
+    def clean(self):
+        """
+        Remove the build directory and the build manifest.
+        """
+        from os import path, mkdir
+        from shutil import rmtree
+        from manifest import loadManifest
+
+        if path.exists(f'./{self.build_dir}'):
+            rmtree(f'./{self.build_dir}')
+        if path.exists('./.bld'):
+            rmtree('./.bld')
+        mkdir('./.bld')
+        self.manifest = loadManifest(self.manifest_path)
+        self.graph = None
 
-    with open('amor.toml', 'r') as conf_file:
-        conf = load(conf_file)
 
-    source_dir = conf["project"]["source_dir"]
-    build_dir = conf["project"]["build_dir"]
-    entry = conf["project"]["entry"]
-    include = conf["build"]["include"]
+    def close(self):
+        """
+        Stop the worker pool.
+        """
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
 
-    lua = LuaRuntime()
 
-    lpath = lua.eval('package.path')
-    cpath = lua.eval('package.cpath')
-    lua_path = f'./.amor/?.lua;./{source_dir}/?.lua;./.amor/?/init.lua;{str(lpath)};'
-    lua_cpath = f';./.amor/?.so;./.amor/?/?.so;./{source_dir}/?.so;{str(cpath)};'
-    
-    if args.clean:
-        rmtree(f'./{build_dir}')
+    def submit(self, fn, *fn_args) -> "Future":
+        """
+        Run a build step in the worker pool, or in this process for --jobs 1.
+        """
+        from concurrent.futures import Future
 
-    if not path.exists('./.bld'):
-        mkdir('./.bld')
+        if self.pool is not None:
+            return self.pool.submit(fn, *fn_args)
+        fut = Future()
+        try:
+            fut.set_result(fn(*fn_args))
+        except Exception as err:
+            fut.set_exception(err)
+        return fut
 
 
-    def recScanSource(file_path: str, mod_map: dict[str, str]) -> dict[str, str]:
-        """
-        Scan the project source for required modules.
-        """
-        with open(file_path, 'r') as src_file:
-            lua_code = ''.join(src_file.readlines())
-
-        lua_ast = ast.parse(lua_code)
-
-        for node in ast.walk(lua_ast): # type: ignore
-            if isinstance(node, astnodes.Call):
-                node: astnodes.Call = node
-                if isinstance(node.func, astnodes.Name):
-                    func: astnodes.Name = node.func # type: ignore
-
-                    if func.id == 'require':
-                        mod: astnodes.String = node.args[0] # type: ignore
-
-                        res = lua.eval(f'package.searchpath("{mod.s}",\
-                                "{lua_path+lua_cpath}")')
-                        if '(None,' in str(res):
-                             if mod.s in love_builtins:
-                                print(f"{mod.s} included with Love")
-                             else:
-                                print(f'Could not find {mod.s}')
-                             continue
-
-                        mod_map[mod.s] = str(res)
-        
-        
-        split_path = file_path.split('/')
-        bld_path = '/'.join(["./.bld"] + split_path[2:]).replace('.lua', '.dat')
-        if len(split_path) > 2 and not split_path[1].endswith('.lua'):
-            for i in range(2, len(split_path)-1):
-                tmp = '/'.join(split_path[2:i+1])
-                if not path.exists(f"./.bld/{tmp}"):
-                    mkdir(f"./.bld/{tmp}")
-       
-        with open(bld_path, 'wb') as dat:
-            pdump(lua_ast, dat)
-
-        print('Scanned', file_path)
-        for p in mod_map.copy().values():
-            if f"./{source_dir}/" in p:
-                print(p)
-                sub_mod_map = recScanSource(p, {})
-                for v in sub_mod_map.keys(): mod_map[v] = sub_mod_map[v]
-
-        return mod_map
-
-    mod_map: dict[str, str] = recScanSource(f'./{source_dir}/{entry}', {})
-                
-    for key in mod_map.keys(): print(key, mod_map[key])
-
-    if not path.exists(f"./{build_dir}"):
-        mkdir(f"./{build_dir}")
-
-    if not path.exists(f"./{build_dir}/ext"):
-        mkdir(f"./{build_dir}/ext")
-
-    for key in mod_map.keys():
-        if not f"./{source_dir}/" in mod_map[key]:
-            copy_path = mod_map[key].split('/')[:-1]
-            mod_dir = copy_path[-1]
-            out_dir = f"./{build_dir}/ext/{mod_dir}"
-            if path.exists(out_dir):
-                rmtree(out_dir)
-            copytree('/'.join(copy_path), f"./{build_dir}/ext/{mod_dir}")
-            print("Copied", mod_map[key])
-            no_init = 'init.lua' not in listdir(f"./{build_dir}/ext/{mod_dir}")
+    def resolveModule(self, mod: str) -> str | None:
+        """
+        Find the file a required module resolves to.
+        """
+        from constants import love_builtins
+
+        res = self.resolver.find(mod)
+        if res is None:
+            if mod in self.generated:
+                pass
+            elif mod in love_builtins:
+                print(f"{mod} included with Love")
+            else:
+                print(f'Could not find {mod}')
+            return None
+        if mod not in self.ambiguous and self.resolver.isAmbiguous(mod):
+            self.ambiguous.add(mod)
+            print(f'{mod} is ambiguous, using {res} over',
+                  *self.resolver.candidates(mod)[1:])
+        return res
+
+
+    def selectLazy(self, requires: dict[str, str | None]) -> list[str]:
+        """
+        Get the required modules that build.lazy selects to load lazily.
+        """
+        from fnmatch import fnmatchcase
+
+        source_prefix = f"./{self.source_dir}/"
+        selected: list[str] = []
+        for mod, res in requires.items():
+            if res is None:
+                continue
+            if any(fnmatchcase(mod, pattern) for pattern in self.lazy_names)\
+                    or (self.lazy_paths is not None and res.startswith(source_prefix)
+                        and self.lazy_paths.match(res[len(source_prefix):])):
+                selected.append(mod)
+        return selected
+
+
+    def scanSource(self, entry_path: str, compiled: dict[str, tuple[str, "Future"]],
+                   dirty: set[str] | None = None) -> "ModuleGraph":
+        """
+        Scan the project source for required modules, breadth-first from the
+        entry file. Each file is scanned once with the lightweight scanner,
+        and changed files are handed to the worker pool to be compiled as
+        soon as they are found.
+
+        If dirty is given, files from the previous graph that are not in it
+        are trusted to be unchanged and are not read again.
+        """
+        from os import path, remove, rmdir, listdir
+        from collections import deque
+        from manifest import hashContent
+        from scanner import scanRequires
+        from graph import ModuleGraph
+        from constants import dev_agent_mod
+
+        previous = self.graph
+        graph = ModuleGraph(self.source_dir, entry_path)
+        out_root = './.bld/modules' if self.bundle else f"./{self.build_dir}"
+        to_visit = deque([entry_path])
+        seen = {entry_path}
+        manifest = self.manifest
+
+        while len(to_visit) > 0:
+            file_path = to_visit.popleft()
+            agent = self.agent and file_path == entry_path
+
+            if dirty is not None and previous is not None\
+                    and file_path in previous.edges and file_path not in dirty\
+                    and file_path in manifest["files"]:
+                graph.addFile(file_path, previous.nodes[file_path],
+                              previous.edges[file_path])
+            else:
+                with open(file_path, 'rb') as src_file:
+                    lua_bytes = src_file.read()
+                digest = hashContent(lua_bytes)
+                chunk_name = '/'.join(file_path.split('/')[2:])
+                out_path = f"{out_root}/{chunk_name}"
+
+                requires: dict[str, str | None] | None = None
+                record = manifest["files"].get(file_path)
+                if record is not None and record["output"] != out_path\
+                        and path.exists(record["output"]):
+                    # Emitted elsewhere before, e.g. before --bundle
+                    remove(record["output"])
+                    parent = path.dirname(record["output"])
+                    while parent not in (f"./{self.build_dir}", './.bld/modules')\
+                            and path.isdir(parent) and len(listdir(parent)) == 0:
+                        rmdir(parent)
+                        parent = path.dirname(parent)
+                if record is not None and record["hash"] == digest\
+                        and record.get("agent", False) == agent\
+                        and record.get("bytecode") == self.bytecode\
+                        and record.get("optimize") == self.optimize\
+                        and record["output"] == out_path and path.exists(out_path):
+                    cached = {mod: self.resolveModule(mod) for mod in record["requires"]}
+                    if cached == record["requires"]\
+                            and record.get("lazy_selected", []) == self.selectLazy(cached):
+                        print('Unchanged', file_path)
+                        requires = cached
+
+                if requires is None:
+                    lua_code = lua_bytes.decode()
+                    names, dynamic = scanRequires(lua_code)
+                    for line in dynamic:
+                        print(f'Could not resolve dynamic require at {file_path}:{line}')
+                    requires = {mod: self.resolveModule(mod) for mod in names}
+
+                    # Requires of installed modules point at the copies in ext/
+                    renames = {mod: f"ext.{mod}" for mod, res in requires.items()
+                               if res is not None and not graph.isSource(res)}
+                    prelude = f'require("{dev_agent_mod}") ' if agent else ''
+                    lazy = self.selectLazy(requires)
+                    compiled[out_path] = (file_path, self.submit(compileFile,
+                                          lua_code, out_path, renames, prelude,
+                                          self.bytecode, chunk_name, set(lazy),
+                                          self.optimize))
+                    manifest["files"][file_path] = {
+                            "hash": digest,
+                            "requires": requires,
+                            "output": out_path,
+                            }
+                    if agent:
+                        manifest["files"][file_path]["agent"] = True
+                    if self.bytecode is not None:
+                        manifest["files"][file_path]["bytecode"] = self.bytecode
+                    if len(lazy) > 0:
+                        manifest["files"][file_path]["lazy_selected"] = lazy
+                    if self.optimize is not None:
+                        manifest["files"][file_path]["optimize"] = self.optimize
+                    print('Scanned', file_path)
+
+                graph.addFile(file_path, len(lua_bytes), requires)
+
+            for res in graph.dependencies(file_path):
+                if graph.isSource(res) and res not in seen:
+                    seen.add(res)
+                    to_visit.append(res)
+
+        return graph
+
+
+    def syncExt(self, mod_map: dict[str, str], rehash: bool = True):
+        """
+        Copy installed modules into the build's ext/ directory, or with
+        --bundle into .bld/ext/ to be bundled, with only their other files,
+        such as native libraries, in the build's ext/. Without rehash, the
+        installed files are known to be unchanged, so packages already synced
+        keep their recorded signature instead of being read.
+        """
+        from os import path, makedirs, listdir, rmdir
+        from shutil import rmtree, copytree, ignore_patterns
+        from constants import init_lua_template_so, init_lua_template_lua
+        from manifest import hashDir
+        from utils import write_if_changed, remove_empty_dirs
+
+        source_dir = self.source_dir
+        build_dir = self.build_dir
+        manifest = self.manifest
+        ext_root = './.bld/ext' if self.bundle else f"./{build_dir}/ext"
+
+        makedirs(ext_root, exist_ok=True)
+
+        # Several required names can resolve into one installed package directory,
+        # each directory is synced once
+        ext_dirs: dict[str, list[str]] = {}
+        for key in mod_map.keys():
+            if not f"./{source_dir}/" in mod_map[key]:
+                pkg_dir = '/'.join(mod_map[key].split('/')[:-1])
+                ext_dirs.setdefault(pkg_dir, []).append(key)
+
+        pins = {name: str(dep).split('=')[-1]
+                for name, dep in (self.conf.get("dependencies") or {}).items()}
+        ext_records: dict[str, dict] = {}
+
+        for pkg_dir, keys in ext_dirs.items():
+            mod_dir = pkg_dir.split('/')[-1]
+            out_dir = f"{ext_root}/{mod_dir}"
+            previous = manifest["ext"].get(mod_dir, {})
+            record = {
+                    "source": pkg_dir,
+                    "pin": pins.get(mod_dir),
+                    "signature": previous["signature"]
+                        if not rehash and previous.get("source") == pkg_dir
+                        else hashDir(pkg_dir),
+                    "bundle": self.bundle,
+                    }
+            if manifest["ext"].get(mod_dir) != record or not path.exists(out_dir):
+                for old_dir in [f"./{build_dir}/ext/{mod_dir}", f"./.bld/ext/{mod_dir}"]:
+                    if path.exists(old_dir):
+                        rmtree(old_dir)
+                copytree(pkg_dir, out_dir)
+                if self.bundle:
+                    native_dir = f"./{build_dir}/ext/{mod_dir}"
+                    copytree(pkg_dir, native_dir, ignore=ignore_patterns('*.lua'))
+                    remove_empty_dirs(native_dir, log=lambda *_: None)
+                    if len(listdir(native_dir)) == 0:
+                        rmdir(native_dir)
+                print("Copied", pkg_dir)
+            ext_records[mod_dir] = record
+
+            # Only the shim for the last name required from the directory is kept
+            key = keys[-1]
+            init_lua_content = None
             if mod_map[key].endswith('.so'):
                 init_lua_content = init_lua_template_so.replace("{mod}", key)
-                with open(f"./{build_dir}/ext/{mod_dir}/init.lua", "w") as init_file:
-                    init_file.writelines(init_lua_content.splitlines(keepends=True))
-                print('Wrote init.lua for *.so')
-            elif no_init:
+            elif not path.exists(f"{pkg_dir}/init.lua"):
                 init_lua_content = init_lua_template_lua.replace("{mod}", key)
-                with open(f"./{build_dir}/ext/{mod_dir}/init.lua", "w") as init_file:
-                    init_file.writelines(init_lua_content.splitlines(keepends=True))
-                print('Wrote init.lua for *.lua')
-
-    
-    def recCompile(directory: str):
+            if init_lua_content is not None\
+                    and write_if_changed(f"{out_dir}/init.lua", init_lua_content):
+                print(f'Wrote init.lua for {key}')
+
+        for mod_dir in manifest["ext"].keys():
+            for old_dir in [f"./{build_dir}/ext/{mod_dir}", f"./.bld/ext/{mod_dir}"]:
+                if mod_dir not in ext_records and path.exists(old_dir):
+                    rmtree(old_dir)
+                    print(f"Removed {old_dir}")
+        if self.bundle and path.isdir(f"./{build_dir}/ext")\
+                and len(listdir(f"./{build_dir}/ext")) == 0:
+            rmdir(f"./{build_dir}/ext")
+        manifest["ext"] = ext_records
+
+
+    def reportLazy(self, graph: "ModuleGraph"):
         """
-        Compile the project source directory.
+        Print the requires made lazy and how many modules load at startup
+        with and without them.
         """
-        dir_list = listdir(directory)
+        lazy: dict[str, list[str]] = {}
+        for file_path in sorted(graph.edges):
+            record = self.manifest["files"].get(file_path, {})
+            if len(record.get("lazy", [])) > 0:
+                lazy[file_path] = record["lazy"]
+                print(f'Lazy in {file_path}:', *record["lazy"])
+            for kept in record.get("lazy_kept", []):
+                print(f'Not lazy in {file_path}: {kept}')
 
-        for dir in dir_list:
-            full_path = directory+'/'+dir
-            if path.isdir(full_path):
-                recCompile(full_path)
-            else:
-                with open(full_path, 'rb') as dat:
-                    tree = pload(dat)
-                
-                comped = ast.to_lua_source(tree)
-
-                comped = sub(r'\s+\(', '(', comped)
-
-                for mod in mod_map.keys():
-                    if not f"./{source_dir}/" in mod_map[mod]:
-                        comped = comped.replace(f"require(\"{mod}", f"require(\"ext.{mod}")
-                        comped = comped.replace(f"require('{mod}",
-                                                          f"require('ext.{mod}")
-
-                out_dir = full_path.split('/')
-                comp_path = '/'.join([f'./{build_dir}'] +
-                                     out_dir[2:]).replace('.dat', '.lua')
-                if len(out_dir) > 2 and not out_dir[1].endswith('.dat'):
-                    for i in range(2, len(out_dir)-1):
-                        tmp = '/'.join(out_dir[2:i+1])
-                        if not path.exists(f'./{build_dir}/{tmp}'):
-                            mkdir(f"./{build_dir}/{tmp}")
-
-                with open(comp_path, 'w') as out:
-                    out.write(comped)
-                print('Built', comp_path)
-        return
+        before = len(graph.reachable(graph.entry_path))
+        after = len(graph.reachable(graph.entry_path, lazy))
+        print(f'Modules loaded at startup: {before} eagerly, {after} with lazy requires')
+
+
+    def checkAssets(self, graph: "ModuleGraph", assets: dict) -> dict:
+        """
+        Warn about assets no source file references, and with
+        build.unused_assets = "prune" leave them out of the build. Assets
+        matching build.asset_keep, e.g. those loaded through dynamic paths,
+        are always kept.
+        """
+        from assets import compilePatterns
+
+        referenced: set[str] = set()
+        for file_path in graph.edges:
+            record = self.manifest["files"].get(file_path, {})
+            referenced.update(record.get("asset_refs", []))
+            for line in record.get("asset_dynamic", []):
+                print(f'Could not resolve dynamic asset path at {file_path}:{line}')
+
+        keep = compilePatterns(self.asset_keep)
+        unused = [rel_path for rel_path in assets if rel_path not in referenced
+                  and (keep is None or not keep.match(rel_path))]
+        pruning = self.unused_assets == 'prune'
+        for rel_path in unused:
+            print(f'{"Pruned" if pruning else "Unreferenced"} asset',
+                  f'./{self.source_dir}/{rel_path}')
+        if len(unused) > 0:
+            print(f'{len(unused)} of {len(assets)} assets are not referenced',
+                  'by the source' + (', pruned from the build' if pruning else ''))
+        if not pruning:
+            return assets
+        return {rel_path: st for rel_path, st in assets.items() if rel_path not in unused}
+
+
+    def isStructural(self, changed_path: str) -> bool:
+        """
+        Check whether a changed path can change how modules resolve: anything
+        outside the source directory (e.g. .amor/), directories (given with a
+        trailing `/`), and Lua modules that were added or removed.
+        """
+        from os import path
 
+        if not changed_path.startswith(f"./{self.source_dir}/")\
+                or changed_path.endswith('/'):
+            return True
+        if changed_path.endswith(('.lua', '.so')):
+            return changed_path not in self.manifest["files"]\
+                    or not path.exists(changed_path)
+        return False
 
-    recCompile('./.bld')
 
-    def recRegisterAssets(dir: str, asset_dict = {}):
+    def build(self, dirty: set[str] | None = None):
         """
-        Register assets in the project source based on the build.include pattern
-        list.
+        Build the project. With dirty, the set of paths changed since the
+        last build, steps the changes cannot affect are skipped.
         """
-        print(f'Checking {dir}...')
-        directory = listdir(dir)
-        
-        for p in directory:
-            print(p)
-            if path.isdir(f"{dir}/{p}"):
-                asset_dict[p] = recRegisterAssets(f"{dir}/{p}", {})
-            else:
-                print(f"Checking {dir}/{p} against", *include)
-                for pattern in include:
-                    if fnmatch(p, pattern):
-                        print(f"Found {dir}/{p}")
-                        asset_dict[p] = True
-                        break
-
-        for key in asset_dict.copy().keys():
-            if type(asset_dict[key]) is dict and len(asset_dict[key].keys()) == 0:
-                del asset_dict[key]
-
-        return asset_dict
-    
-
-    def recCopyAssets(dir: str, asset_dict: dict):
-        """
-        Recursively copy assets based on the output of recRegisterAssets.
-        """
-        if not path.exists(f"./{build_dir}/{dir}"):
-            mkdir(f"./{build_dir}/{dir}")
-        
-        for key in asset_dict.keys():
-            if type(asset_dict[key]) == dict:
-                recCopyAssets(f"{dir}/{key}", asset_dict[key])
-            else:
-                print(f"Copying ./{source_dir}/{dir}/{key}...")
-                copyfile(f"./{source_dir}/{dir}/{key}",
-                         f"./{build_dir}/{dir}/{key}")
+        from os import path, remove
+        from manifest import saveManifest
+        from assets import findAssets, syncAssets
+        from constants import dev_agent_mod, dev_agent_lua
+        from utils import write_if_changed
+        from bundle import writeBundle
+        from atlas import syncAtlases
+        from transform import syncTransforms
+
+        source_dir = self.source_dir
+        build_dir = self.build_dir
+        manifest = self.manifest
+
+        if dirty is not None and any(self.isStructural(p) for p in dirty):
+            # Modules may resolve differently now, so start from a full scan
+            self.indexModules()
+            dirty = None
+
+        compiled: dict[str, tuple[str, "Future"]] = {}
+        graph = self.scanSource(f'./{source_dir}/{self.entry}', compiled, dirty)
+
+        for file_path, record in manifest["files"].copy().items():
+            if file_path not in graph.edges:
+                # Source no longer required, drop its output from the build
+                if path.exists(record["output"]):
+                    remove(record["output"])
+                    print('Removed', record["output"])
+                del manifest["files"][file_path]
+
+        if self.args.graph is not None:
+            graph.export(self.args.graph)
+
+        mod_map = graph.moduleMap()
+
+        for key in mod_map.keys(): print(key, mod_map[key])
+
+        # Sources may have started or stopped requiring installed modules
+        self.syncExt(mod_map, rehash=dirty is None)
+
+        if dirty is None:
+            agent_path = f"./{build_dir}/{dev_agent_mod}.lua"
+            if self.agent:
+                write_if_changed(agent_path, dev_agent_lua)
+            elif path.exists(agent_path):
+                remove(agent_path)
+
+        try:
+            for out_path in sorted(compiled):
+                file_path, fut = compiled[out_path]
+                try:
+                    _, lazied, kept, asset_refs, asset_dynamic = fut.result()
+                    print('Built', out_path)
+                    record = manifest["files"][file_path]
+                    if len(lazied) > 0:
+                        record["lazy"] = lazied
+                    if len(kept) > 0:
+                        record["lazy_kept"] = kept
+                    record["asset_refs"] = asset_refs
+                    if len(asset_dynamic) > 0:
+                        record["asset_dynamic"] = asset_dynamic
+                except:
+                    # Not built, so it must be compiled again next time
+                    del manifest["files"][file_path]
+                    raise
+
+            if len(self.lazy_names) > 0 or self.lazy_paths is not None:
+                self.reportLazy(graph)
+        finally:
+            self.graph = graph
+            saveManifest(self.manifest_path, manifest)
+
+        # Pruning depends on the source as well as the assets
+        if dirty is None or self.unused_assets == 'prune'\
+                or any(not p.endswith('.lua') for p in dirty):
+            assets = findAssets(source_dir, self.include, self.exclude)
+            print(f"Found {len(assets)} assets")
+            if len(self.atlases) > 0 or len(manifest["atlas"]) > 0:
+                assets, manifest["atlas"] = syncAtlases(
+                        self.atlases, assets, source_dir, build_dir, manifest["atlas"],
+                        self.submit, './.bld/atlas' if self.bundle else None)
+            if self.unused_assets != 'keep':
+                assets = self.checkAssets(graph, assets)
+            asset_records = manifest["assets"]
+            if len(self.transforms) > 0 or len(manifest["transforms"]) > 0:
+                assets, manifest["transforms"] = syncTransforms(
+                        self.transforms, assets, source_dir, build_dir,
+                        manifest["transforms"], self.asset_mode, self.submit)
+                # Outputs of transforms are not removed as deleted assets
+                asset_records = {rel_path: record for rel_path, record in asset_records.items()
+                                 if rel_path not in manifest["transforms"]}
+            manifest["assets"] = syncAssets(assets, source_dir, build_dir,
+                                            asset_records, self.asset_mode,
+                                            self.asset_hash)
+            saveManifest(self.manifest_path, manifest)
+
+        # Bundled last, as atlas modules are generated with the assets
+        if self.bundle:
+            writeBundle(graph, manifest["files"], build_dir, graph.entry_path,
+                        sorted(manifest["atlas"]))
         return
 
 
-    print(include)
-    assets = recRegisterAssets(f"./{source_dir}")
-    print(*assets)
-    if len(assets.keys()) > 0:
-        print("Found assets")
-        print(assets)
-        recCopyAssets("", assets)
-    else:
-        print("No assets found")
-    return
+def buildOpt(args: Namespace):
+    """
+    Build the project.
+    """
+    builder = Builder(args)
+    try:
+        if not builder.load():
+            return
 
+        if args.clean:
+            builder.clean()
 
+        builder.build()
+
+        if args.watch:
+            from watch import watchBuild
+            watchBuild(builder)
+    finally:
+        builder.close()
+    return
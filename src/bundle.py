@@ -0,0 +1,99 @@
+# Single file bundles
+
+def luaString(chunk: bytes, long: bool = True) -> str:
+    """
+    Quote a Lua chunk, source or bytecode, as a Lua string literal. With long,
+    source is kept readable in a long bracket string, everything else is
+    escaped.
+    """
+    try:
+        text = None if not long or chunk.startswith(b'\x1b') else chunk.decode()
+    except UnicodeDecodeError:
+        text = None
+
+    if text is not None and '\r' not in text:
+        level = 0
+        while True:
+            close = f"]{'=' * level}]"
+            if (text + close).find(close) == len(text):
+                break
+            level += 1
+        # The newline after the opening bracket is not part of the string
+        return f"[{'=' * level}[\n{text}{close}"
+
+    return '"' + ''.join(chr(b) if 32 <= b < 127 and b not in (34, 92)
+                         else f"\\{b:03d}" for b in chunk) + '"'
+
+
+def writeBundle(graph, records: dict[str, dict], build_dir: str,
+                entry_path: str, atlases: list[str] = []) -> int:
+    """
+    Write the project into a single entry file. Every source module,
+    installed module (from .bld/ext/) and generated atlas module (from
+    .bld/atlas/) is registered in package.preload under each name it is
+    required by, in dependency order, and loaded from a string with its own
+    chunk name so tracebacks are unchanged. Installed C modules keep their
+    loadlib shims, with the libraries left in the build's ext/. Returns the
+    number of modules bundled.
+    """
+    from os import path, walk
+    from utils import write_if_changed
+
+    def readChunk(file_path: str) -> bytes:
+        with open(file_path, 'rb') as chunk_file:
+            return chunk_file.read()
+
+    names: dict[str, list[str]] = {}
+    for file_path in sorted(graph.edges):
+        for mod, res in graph.edges[file_path].items():
+            if res is not None and graph.isSource(res) and mod not in names.setdefault(res, []):
+                names[res].append(mod)
+
+    lines = [
+            "-- Bundled by amor",
+            "local load = loadstring or load",
+            "local preload = package.preload",
+            ]
+
+    def quote(name: str) -> str:
+        return luaString(name.encode(), long=False)
+
+    def register(mods: list[str], chunk_name: str, chunk: bytes):
+        lines.append(f"preload[{quote(mods[0])}] = function(...)")
+        lines.append(f"  return assert(load({luaString(chunk)}, {quote(f'@{chunk_name}')}))(...)")
+        lines.append("end")
+        for mod in mods[1:]:
+            lines.append(f"preload[{quote(mod)}] = preload[{quote(mods[0])}]")
+
+    count = 0
+    for root, dirs, files in walk("./.bld/ext"):
+        dirs.sort()
+        for file in sorted(files):
+            if not file.endswith('.lua'):
+                continue
+            chunk_name = path.relpath(path.join(root, file), "./.bld").replace(path.sep, '/')
+            mod = chunk_name[:-len('.lua')].replace('/', '.')
+            if mod.endswith('.init'):
+                mod = mod[:-len('.init')]
+            register([mod], chunk_name, readChunk(path.join(root, file)))
+            count += 1
+
+    for name in atlases:
+        register([f"atlas.{name}"], f"atlas/{name}.lua", readChunk(f"./.bld/atlas/{name}.lua"))
+        count += 1
+
+    for file_path in graph.dependencyOrder():
+        if file_path == entry_path or file_path not in names:
+            continue
+        chunk_name = '/'.join(file_path.split('/')[2:])
+        register(names[file_path], chunk_name, readChunk(records[file_path]["output"]))
+        count += 1
+
+    entry_chunk = readChunk(records[entry_path]["output"])
+    entry_name = '/'.join(entry_path.split('/')[2:])
+    lines.append(f"return assert(load({luaString(entry_chunk)}, {quote(f'@{entry_name}')}))(...)")
+
+    out_path = f"./{build_dir}/{entry_name}"
+    if write_if_changed(out_path, '\n'.join(lines) + '\n'):
+        print(f'Bundled {count} modules into {out_path}')
+    return count
@@ -0,0 +1,116 @@
+# Lua bytecode precompilation
+
+# lupa runtimes, one per target VM, created on first use in each process
+_runtimes: dict = {}
+
+# Precompiled chunks, content-addressed by target VM, chunk name and source
+cache_dir = './.bld/bytecode'
+
+
+def bytecodeTarget(build_conf: dict) -> str | None:
+    """
+    Get the target of the build.bytecode stage from the [build] config, or
+    None if it is off. Targets are either `lupa:<vm>`, dumping with the lupa
+    runtime for that VM (e.g. luajit21, as used by Löve), or `cmd:<command>`
+    for an external compiler.
+    """
+    if not build_conf.get("bytecode", False):
+        return None
+    command = build_conf.get("bytecode_command", "")
+    if command != "":
+        return f"cmd:{command}"
+    return f"lupa:{build_conf.get('bytecode_vm', 'luajit21')}"
+
+
+def checkTarget(target: str) -> bool:
+    """
+    Check a bytecode target can be used here, printing why not if it cannot.
+    """
+    from importlib import import_module
+    from shlex import split
+    from shutil import which
+
+    kind, spec = target.split(':', 1)
+    if kind == 'lupa':
+        try:
+            import_module(f"lupa.{spec}")
+        except ImportError:
+            print(f'lupa has no "{spec}" runtime for build.bytecode_vm')
+            return False
+    elif which(split(spec)[0]) is None:
+        print(f'Could not find {split(spec)[0]} for build.bytecode_command')
+        return False
+    return True
+
+
+def _dumpLupa(vm: str, source: bytes, chunk_name: str) -> bytes:
+    """
+    Compile a chunk with string.dump in a lupa runtime.
+    """
+    from importlib import import_module
+
+    if vm not in _runtimes:
+        lua = import_module(f"lupa.{vm}").LuaRuntime(encoding=None)
+        _runtimes[vm] = lua.eval(b"""function(src, name)
+            local f, err = (loadstring or load)(src, name)
+            if not f then error(err, 0) end
+            return string.dump(f)
+        end""")
+    return _runtimes[vm](source, chunk_name.encode())
+
+
+def _dumpCommand(command: str, source: bytes, chunk_name: str) -> bytes:
+    """
+    Compile a chunk with an external compiler, e.g. `luajit -b {input}
+    {output}` or `luac -o {output} {input}`.
+    """
+    from os import path, makedirs
+    from shlex import split
+    from subprocess import run, PIPE
+    from tempfile import TemporaryDirectory
+
+    with TemporaryDirectory() as tmp_dir:
+        # Compiled from within the temporary directory so the chunk is named
+        # by its path in the build directory
+        in_path = path.join(tmp_dir, chunk_name)
+        makedirs(path.dirname(in_path), exist_ok=True)
+        with open(in_path, 'wb') as in_file:
+            in_file.write(source)
+        args = [arg.replace('{input}', chunk_name).replace('{output}', f"{chunk_name}c")
+                for arg in split(command)]
+        proc = run(args, cwd=tmp_dir, stdout=PIPE, stderr=PIPE)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{args[0]} failed on {chunk_name}: "
+                               + proc.stderr.decode(errors='replace').strip())
+        with open(f"{in_path}c", 'rb') as out_file:
+            return out_file.read()
+
+
+def compileBytecode(source: str, chunk_name: str, target: str) -> bytes:
+    """
+    Precompile emitted Lua source to bytecode for the target, reusing the
+    cached result for the same source, chunk name and target. chunk_name is
+    the module's path in the build directory, as Löve would name it.
+    """
+    from os import path, makedirs, replace, getpid
+    from manifest import hashContent
+
+    source_bytes = source.encode()
+    key = hashContent(b'\0'.join([target.encode(), chunk_name.encode(), source_bytes]))
+    cache_path = f"{cache_dir}/{key[:2]}/{key}"
+    if path.exists(cache_path):
+        with open(cache_path, 'rb') as cache_file:
+            return cache_file.read()
+
+    kind, spec = target.split(':', 1)
+    if kind == 'lupa':
+        code = _dumpLupa(spec, source_bytes, f"@{chunk_name}")
+    else:
+        code = _dumpCommand(spec, source_bytes, chunk_name)
+
+    makedirs(path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.{getpid()}.tmp"
+    with open(tmp_path, 'wb') as cache_file:
+        cache_file.write(code)
+    replace(tmp_path, cache_path)
+    return code
@@ -0,0 +1,213 @@
+from argparse import Namespace
+
+# How an installed module was built, see install.buildModule
+build_methods = ["rockspec", "makefile", "source"]
+
+
+def moduleCacheDir() -> str:
+    """
+    Get the directory of the installed module cache, shared between
+    projects.
+    """
+    from os import path
+    from utils import getCacheDir
+    return path.join(getCacheDir(), "modules")
+
+
+def moduleKey(repo: str, commit: str, lua_version: str, method: str) -> str:
+    """
+    Get the cache key of a module built from a repository at a commit, for a
+    Lua version and by a build method.
+    """
+    from json import dumps
+    from manifest import hashContent
+    return hashContent(dumps([repo, commit, lua_version, method]).encode())
+
+
+def findCachedModule(repo: str, commit: str, lua_version: str,
+                     method: str | None = None) -> str | None:
+    """
+    Get the cache entry of a module built by method, or by whichever build
+    method made it, or None if it has not been cached.
+    """
+    from os import path
+
+    for method in build_methods if method is None else [method]:
+        key = moduleKey(repo, commit, lua_version, method)
+        entry = path.join(moduleCacheDir(), key[:2], key)
+        if path.exists(path.join(entry, "meta.json")):
+            return entry
+    return None
+
+
+def readEntry(entry: str) -> dict:
+    """
+    Read the metadata of a cache entry, with when it was last used.
+    """
+    from os import path
+    from json import load
+
+    with open(path.join(entry, "meta.json"), 'r') as meta_file:
+        meta = load(meta_file)
+    meta["entry"] = entry
+    meta["used"] = path.getmtime(path.join(entry, "meta.json"))
+    return meta
+
+
+def storeModule(mod_dir: str, repo: str, commit: str, lua_version: str,
+                method: str, mod_name: str) -> str:
+    """
+    Copy an installed module into the cache. The entry is written next to
+    its final path and renamed into place, so concurrent installs never see
+    half of one. Returns the entry.
+    """
+    from os import path, makedirs, walk, rename, getpid
+    from shutil import copytree, rmtree
+    from json import dump
+
+    key = moduleKey(repo, commit, lua_version, method)
+    entry = path.join(moduleCacheDir(), key[:2], key)
+    if path.exists(entry):
+        return entry
+
+    tmp_entry = f"{entry}.{getpid()}.tmp"
+    if path.exists(tmp_entry):
+        rmtree(tmp_entry)
+    makedirs(path.dirname(entry), exist_ok=True)
+    copytree(mod_dir, path.join(tmp_entry, "files"))
+
+    size = sum(path.getsize(path.join(root, file))
+               for root, _, files in walk(tmp_entry) for file in files)
+    with open(path.join(tmp_entry, "meta.json"), 'w') as meta_file:
+        dump({
+                "repo": repo,
+                "commit": commit,
+                "lua_version": lua_version,
+                "method": method,
+                "name": mod_name,
+                "size": size,
+                }, meta_file, indent=2)
+
+    try:
+        rename(tmp_entry, entry)
+    except OSError:
+        # Stored by another install in the meantime
+        rmtree(tmp_entry)
+    return entry
+
+
+def materializeModule(entry: str, amor_dir: str = './.amor') -> dict:
+    """
+    Place a cached module in amor_dir by hardlinking its files, or copying
+    them where links cannot be made. Marks the entry as used, for pruning.
+    Returns the entry's metadata.
+    """
+    from os import path, walk, utime, makedirs
+    from shutil import rmtree
+    from assets import placeAsset
+
+    meta = readEntry(entry)
+    dest_dir = path.join(amor_dir, meta["name"])
+    files_dir = path.join(entry, "files")
+    if path.exists(dest_dir):
+        rmtree(dest_dir)
+    makedirs(dest_dir)
+    for root, _, files in walk(files_dir):
+        for file in files:
+            rel_path = path.relpath(path.join(root, file), files_dir)
+            placeAsset(path.join(root, file), path.join(dest_dir, rel_path), 'hardlink')
+
+    utime(path.join(entry, "meta.json"))
+    return meta
+
+
+def listEntries() -> list[dict]:
+    """
+    Read every entry of the module cache, most recently used first.
+    """
+    from os import path, listdir
+
+    cache_dir = moduleCacheDir()
+    entries = []
+    if not path.isdir(cache_dir):
+        return entries
+    for prefix in sorted(listdir(cache_dir)):
+        for key in sorted(listdir(path.join(cache_dir, prefix))):
+            entry = path.join(cache_dir, prefix, key)
+            if key.endswith('.tmp') or not path.exists(path.join(entry, "meta.json")):
+                continue
+            entries.append(readEntry(entry))
+    return sorted(entries, key=lambda meta: meta["used"], reverse=True)
+
+
+def formatSize(size: float) -> str:
+    """
+    Format a size in bytes for display.
+    """
+    if size < 1024:
+        return f"{size:.0f} B"
+    for unit in ["KiB", "MiB", "GiB"]:
+        size /= 1024
+        if size < 1024 or unit == "GiB":
+            break
+    return f"{size:.1f} {unit}"
+
+
+def parseSize(text: str) -> int:
+    """
+    Parse a size such as "500M" or "2G" into bytes. Raises ValueError for
+    sizes that cannot be read.
+    """
+    units = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    text = text.strip().upper().removesuffix("IB").removesuffix("B")
+    unit = text[-1] if len(text) > 0 and text[-1] in units else ""
+    return int(float(text[:len(text) - len(unit)]) * units[unit])
+
+
+def cacheLsOpt(args: Namespace):
+    """
+    List the modules in the cache, most recently used first.
+    """
+    from time import strftime, localtime
+
+    entries = listEntries()
+    for meta in entries:
+        print(f"{meta['name']:<20} {meta['repo']}@{meta['commit'][:10]}",
+              f"lua {meta['lua_version']}, {meta['method']},",
+              f"{formatSize(meta['size'])}, used",
+              strftime('%Y-%m-%d %H:%M', localtime(meta['used'])))
+    print(f"{len(entries)} modules, {formatSize(sum(m['size'] for m in entries))}",
+          f"in {moduleCacheDir()}")
+    return
+
+
+def cachePruneOpt(args: Namespace):
+    """
+    Remove the least recently used modules from the cache until it fits in
+    --max-size, or every module with --all.
+    """
+    from os import path, listdir, rmdir
+    from shutil import rmtree
+
+    try:
+        max_size = 0 if args.all else parseSize(args.max_size)
+    except ValueError:
+        print(f'Could not read size "{args.max_size}", expected e.g. 500M or 2G')
+        return
+
+    entries = listEntries()
+    total = sum(meta["size"] for meta in entries)
+    removed = 0
+    freed = 0
+    for meta in reversed(entries):
+        if total - freed <= max_size:
+            break
+        rmtree(meta["entry"])
+        if len(listdir(path.dirname(meta["entry"]))) == 0:
+            rmdir(path.dirname(meta["entry"]))
+        removed += 1
+        freed += meta["size"]
+
+    print(f"Removed {removed} modules, freeing {formatSize(freed)},",
+          f"{formatSize(total - freed)} left")
+    return
@@ -16,6 +16,15 @@ default_conf = {
                 "include": [
                     "*.png",
                     ],
+                "exclude": [],
+                "asset_mode": "copy",
+                "asset_hash": False,
+                "bytecode": False,
+                "lazy": [],
+                "unused_assets": "keep",
+                "asset_keep": [],
+                "optimize": False,
+                "defines": {},
                 },
             "scripts": {
                 "test": "echo \"Hello, World!\"",
@@ -84,8 +93,97 @@ package.loaded["{mod}"] = mod
 return mod
 """
 
+# Löve functions whose first argument is the path of an asset to load
+asset_loaders = [
+        "newImage", "newArrayImage", "newCubeImage", "newVolumeImage",
+        "newImageData", "newCompressedData", "newImageFont", "newFont",
+        "newSource", "newSoundData", "newDecoder", "newVideo",
+        "newVideoStream", "newFileData", "newShader",
+        ]
+
+# Build settings for assets not referenced by the source
+unused_asset_modes = ["keep", "warn", "prune"]
+
 love_builtins = [
         "enet",
         "socket",
         "utf8"
         ]
+
+# Module injected into dev builds to hot-swap changed modules. The dev loop
+# writes a sequence number followed by the changed module names to the file
+# named by AMOR_DEV_CHANNEL.
+dev_agent_mod = "amor_dev"
+
+dev_agent_lua = """\
+local channel = os.getenv("AMOR_DEV_CHANNEL")
+if not channel or not love then return end
+
+local seen = nil
+local checked = 0
+
+local function swap(old, new)
+    for k in pairs(old) do
+        if new[k] == nil then old[k] = nil end
+    end
+    for k, v in pairs(new) do old[k] = v end
+    return setmetatable(old, getmetatable(new))
+end
+
+local function reload(name)
+    local old = package.loaded[name]
+    package.loaded[name] = nil
+    local ok, new = pcall(require, name)
+    if not ok then
+        package.loaded[name] = old
+        print("[amor] failed to reload " .. name .. ": " .. tostring(new))
+        return
+    end
+    if type(old) == "table" and type(new) == "table" then
+        package.loaded[name] = swap(old, new)
+    end
+    print("[amor] reloaded " .. name)
+end
+
+local function poll()
+    -- love.timer is nil when conf.lua disables it
+    local now = love.timer and love.timer.getTime() or os.clock()
+    if now - checked < 0.25 then return end
+    checked = now
+
+    local file = io.open(channel, "r")
+    if not file then return end
+    local seq = file:read("*l")
+    if seq ~= seen then
+        local first = seen == nil
+        seen = seq
+        for name in file:lines() do
+            if not first then reload(name) end
+        end
+    end
+    file:close()
+end
+
+local run = love.run
+function love.run()
+    local loop = run()
+    return function()
+        poll()
+        return loop()
+    end
+end
+"""
+
+# Helper prepended, on the first line, to files with lazy requires. The proxy
+# it returns requires the real module on first use and forwards indexing,
+# assignment and calls to it, the only uses build.lazy allows.
+lazy_require_fn = "__amor_lazy"
+
+lazy_require_lua = "local function __amor_lazy(name) "\
+        "local mod "\
+        "local function get() if mod == nil then mod = require(name) end return mod end "\
+        "return setmetatable({}, {"\
+        "__index = function(_, k) return get()[k] end, "\
+        "__newindex = function(_, k, v) get()[k] = v end, "\
+        "__call = function(_, ...) return get()(...) end}) "\
+        "end "
@@ -0,0 +1,95 @@
+from argparse import Namespace
+
+def devOpt(args: Namespace):
+    """
+    Build the project and run it in Löve2D, rebuilding on change. Changed
+    modules are hot-swapped into the running game where possible, otherwise
+    Löve is restarted.
+    """
+    from os import path, replace
+    from subprocess import Popen
+
+    from build import Builder
+    from love import launchLove
+    from watch import watchBuild
+
+    builder = Builder(args)
+    builder.agent = True
+    channel = path.abspath('./.bld/dev_channel')
+    game: list[Popen] = []
+    sequence = 0
+
+    def start():
+        """
+        (Re)start Löve on the build directory.
+        """
+        if len(game) > 0:
+            if game[0].poll() is None:
+                print('Restarting Löve...')
+                game[0].terminate()
+                game[0].wait()
+            game.clear()
+        game.append(launchLove(builder.build_dir,
+                               {"AMOR_DEV_CHANNEL": channel}))
+
+
+    def swappable(changed: set[str]) -> dict[str, list[str]] | None:
+        """
+        Get the module names to reload for each changed file, or None if the
+        change needs a restart (assets, config, installed modules, the entry
+        file, or files not in the module graph).
+        """
+        graph = builder.graph
+        if graph is None:
+            return None
+
+        entry_path = f"./{builder.source_dir}/{builder.entry}"
+        names: dict[str, list[str]] = {}
+        for changed_path in changed:
+            if changed_path not in graph.edges and not path.exists(changed_path):
+                # e.g. an editor's temporary file
+                continue
+            if not changed_path.endswith('.lua') or changed_path == entry_path\
+                    or changed_path not in graph.edges:
+                return None
+            names[changed_path] = []
+
+        for file_path in graph.edges:
+            for mod, res in graph.edges[file_path].items():
+                if res in names and mod not in names[res]:
+                    names[res].append(mod)
+        return names
+
+
+    def onBuild(changed: set[str]):
+        """
+        Hot-swap or restart the game after a rebuild.
+        """
+        nonlocal sequence
+
+        names = swappable(changed)
+        if names is None or len(game) == 0 or game[0].poll() is not None:
+            start()
+            return
+
+        sequence += 1
+        with open(f"{channel}.tmp", 'w') as channel_file:
+            channel_file.write(f"{sequence}\n")
+            for mods in names.values():
+                for mod in mods:
+                    channel_file.write(f"{mod}\n")
+        replace(f"{channel}.tmp", channel)
+        print('Hot-swapping', *[mod for mods in names.values() for mod in mods])
+
+
+    try:
+        if not builder.load():
+            return
+        builder.build()
+        start()
+        watchBuild(builder, on_build=onBuild)
+    finally:
+        builder.close()
+        if len(game) > 0 and game[0].poll() is None:
+            game[0].terminate()
+    return
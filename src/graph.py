@@ -0,0 +1,146 @@
+# Module graph
+
+class ModuleGraph:
+    """
+    The require graph of a project. Nodes are resolved files, edges are the
+    requires between them. Project files are scanned once each; files outside
+    the source directory (installed modules) are leaves.
+    """
+
+    def __init__(self, source_dir: str, entry_path: str):
+        self.source_dir = source_dir
+        self.entry_path = entry_path
+        # File path -> size in bytes
+        self.nodes: dict[str, int] = {}
+        # File path -> required module name -> resolved file, None if unresolved
+        self.edges: dict[str, dict[str, str | None]] = {}
+
+
+    def isSource(self, file_path: str) -> bool:
+        """
+        Check whether a resolved file belongs to the project source.
+        """
+        return f"./{self.source_dir}/" in file_path
+
+
+    def addFile(self, file_path: str, size: int, requires: dict[str, str | None]):
+        """
+        Add a scanned file and its requires to the graph.
+        """
+        from os import path
+
+        self.nodes[file_path] = size
+        self.edges[file_path] = requires
+        for res in requires.values():
+            if res is not None and res not in self.nodes and not self.isSource(res):
+                self.nodes[res] = path.getsize(res) if path.exists(res) else 0
+                self.edges[res] = {}
+
+
+    def dependencies(self, file_path: str, skip: list[str] = []) -> list[str]:
+        """
+        Get the files a file requires directly, except by the module names in
+        skip.
+        """
+        deps: list[str] = []
+        for mod, res in self.edges.get(file_path, {}).items():
+            if res is not None and res not in deps and mod not in skip:
+                deps.append(res)
+        return deps
+
+
+    def dependents(self) -> dict[str, list[str]]:
+        """
+        Get the files that directly require each file.
+        """
+        required_by: dict[str, list[str]] = {file_path: [] for file_path in self.nodes}
+        for file_path in sorted(self.edges):
+            for dep in self.dependencies(file_path):
+                required_by.setdefault(dep, []).append(file_path)
+        return required_by
+
+
+    def reachable(self, file_path: str, lazy: dict[str, list[str]] = {}) -> list[str]:
+        """
+        Get every file loaded when a file is required, including itself.
+        Requires listed in lazy for a file are not followed. Safe for require
+        cycles.
+        """
+        from collections import deque
+
+        seen = {file_path}
+        to_visit = deque([file_path])
+        while len(to_visit) > 0:
+            current = to_visit.popleft()
+            for dep in self.dependencies(current, lazy.get(current, [])):
+                if dep not in seen:
+                    seen.add(dep)
+                    to_visit.append(dep)
+        return sorted(seen)
+
+
+    def dependencyOrder(self) -> list[str]:
+        """
+        Get the source files reachable from the entry file, each after the
+        files it requires. Files in a require cycle are ordered as found.
+        """
+        order: list[str] = []
+        seen = {self.entry_path}
+        stack = [(self.entry_path, iter(self.dependencies(self.entry_path)))]
+        while len(stack) > 0:
+            file_path, deps = stack[-1]
+            dep = next(deps, None)
+            if dep is None:
+                stack.pop()
+                order.append(file_path)
+            elif self.isSource(dep) and dep not in seen:
+                seen.add(dep)
+                stack.append((dep, iter(self.dependencies(dep))))
+        return order
+
+
+    def moduleMap(self) -> dict[str, str]:
+        """
+        Map each resolved module name to its file, in a stable order.
+        """
+        mod_map: dict[str, str] = {}
+        for file_path in sorted(self.edges):
+            for mod, res in self.edges[file_path].items():
+                if res is not None:
+                    mod_map[mod] = res
+        return mod_map
+
+
+    def export(self, out_path: str):
+        """
+        Write the graph as JSON with fan-in, fan-out and the number and size
+        of files loaded by requiring each module.
+        """
+        from json import dump
+
+        required_by = self.dependents()
+        modules = {}
+        for file_path in sorted(self.nodes):
+            loaded = self.reachable(file_path)
+            modules[file_path] = {
+                    "source": self.isSource(file_path),
+                    "size": self.nodes[file_path],
+                    "requires": self.edges[file_path],
+                    "required_by": required_by[file_path],
+                    "fan_in": len(required_by[file_path]),
+                    "fan_out": len(self.dependencies(file_path)),
+                    "load_count": len(loaded),
+                    "load_size": sum(self.nodes.get(dep, 0) for dep in loaded),
+                    }
+
+        with open(out_path, 'w') as graph_file:
+            dump({"entry": self.entry_path, "modules": modules}, graph_file,
+                 indent=2)
+
+        print(f'Wrote module graph to {out_path}')
+        heaviest = sorted(modules, key=lambda m: modules[m]["load_size"],
+                          reverse=True)
+        for file_path in heaviest[:5]:
+            module = modules[file_path]
+            print(f'  {file_path}: loads {module["load_count"]} files,',
+                  f'{module["load_size"]} bytes, required by {module["fan_in"]}')
@@ -1,14 +1,16 @@
 from argparse import Namespace
+from typing import Callable
 
-def installOpt(args: Namespace):
+def buildModule(work_dir: str, mod_name: str, log: Callable) -> tuple[str, str]:
     """
-    Install given repositor(y/ies) or all repositories in the project amor.toml.
+    Build a fetched module in its work directory and copy the result to
+    ./.amor/, from its rockspec or Makefile, or by copying its Lua and
+    shared library files. Returns the name of the installed module and the
+    build method used (see cache.build_methods).
     """
-    from os import listdir, path, getcwd, environ
+    from os import listdir, path, environ
     from shutil import rmtree, copytree
-    from toml import load, dump
-    from git import Repo
-    from subprocess import PIPE, run as cmd
+    from subprocess import PIPE, STDOUT, run as cmd
     try:
         from lupa.lua54 import LuaRuntime
     except ImportError:
@@ -20,12 +22,317 @@ def installOpt(args: Namespace):
             except ImportError:
                 from lupa.lua51 import LuaRuntime
 
+    from utils import include_patterns, remove_empty_dirs
+
+    dir_content = listdir(work_dir)
+    rockspecs = [file for file in dir_content if file.endswith('.rockspec')]
+    makefiles = [file for file in dir_content if "Makefile" in file]
+
+    built_from_spec = False
+    built_from_rockspec = False
+    built_from_makefile = False
+    try:
+        if len(rockspecs) > 0:
+            log('Building from Rockspec...')
+            res = cmd(["luarocks", "build", rockspecs[0], f'--tree="build"',], cwd=work_dir,
+                  stdout=PIPE, stderr=STDOUT, text=True)
+
+            for line in res.stdout.splitlines(): log(line)
+
+            res.check_returncode()
+
+            with open(f"{work_dir}/{rockspecs[0]}", 'r') as rs:
+                rspec = rs.readlines()
+
+            rspec.append(
+                    "if build and package then return { package = package,\
+                                                       modules = build.modules} end\n"
+                    )
+            lua = LuaRuntime()
+            build_modules = dict(lua.execute(''.join(rspec))) # type: ignore
+            log(build_modules)
+            mods: list[str] = [mod for mod in build_modules["modules"]] # type: ignore
+            package: str | None = build_modules['package'] # type: ignore
+
+            log(*mods)
+            log(build_modules["package"]) # type: ignore
+            has_package = package is not None
+            renamed_mod = list(filter(lambda m: '.' not in m, mods))
+            mismatch_module_name = len(renamed_mod) != 0 and package not in renamed_mod
+            log(*renamed_mod)
+
+            if has_package:
+                log('has package', package)
+                mod_name = package
+            if mismatch_module_name:
+                log('but has mismatch', renamed_mod[0])
+                mod_name = renamed_mod[0]
+            if not has_package and not mismatch_module_name and len(mods) > 0:
+                log('fallback')
+                mod_name = mods[0]
+
+            if path.exists(f"./.amor/{mod_name}"):
+                rmtree(f"./.amor/{mod_name}")
+
+            try:
+                copytree(f"{work_dir}/build/lib/lua/5.4/", f"./.amor/{mod_name}/")
+            except:
+                log("Default build location not found, trying fallback...")
+                try:
+                    copytree(f"{work_dir}/build/share/lua/5.4/{mod_name}/",
+                         f"./.amor/{mod_name}/")
+                except:
+                    log(f"Uh oh! {mod_name} could not be built!")
+                    raise
+            built_from_rockspec = True
+
+        elif len(makefiles) > 0:
+            log('Building from Makefile...')
+            for makefile in makefiles:
+                with open(f"{work_dir}/{makefile}", "r") as mf:
+                    lines = mf.readlines()
+
+                for i in range(len(lines)):
+                    if 'config' in lines[i] or 'CONFIG' in lines[i]:
+                        lines[i] = f"# {lines[i]}"
+
+                with open(f"{work_dir}/{makefile}", "w") as mf:
+                    mf.writelines(lines)
+
+            LUA_INCLUDE = environ.copy()["LUA_INCLUDE"]
+            log(LUA_INCLUDE)
+            res = cmd(["make", f"--include-dir={LUA_INCLUDE}"], stdout=PIPE,
+                      stderr=STDOUT, shell=True, text=True, cwd=work_dir)
+
+            for line in res.stdout.splitlines(): log(line)
+
+            res.check_returncode()
+            built_from_makefile = True
+    except:
+        log('Something went wrong whilst building, attempting source copy...')
+    else:
+        log('No errors!')
+        built_from_spec = built_from_rockspec or built_from_makefile
+    finally:
+        log('Final checks...')
+        if not built_from_spec:
+            log('No build option found! Copying files...')
+
+            if path.exists(f"./.amor/{mod_name}"):
+                rmtree(f"./.amor/{mod_name}")
+
+            copytree(work_dir, f"./.amor/{mod_name}",
+                    ignore=include_patterns("*.lua", "*.so"))
+
+            remove_empty_dirs(f"./.amor/{mod_name}/", log)
+
+    if built_from_rockspec:
+        return mod_name, "rockspec"
+    if built_from_makefile:
+        return mod_name, "makefile"
+    return mod_name, "source"
+
+
+def fetchedBytes(work_dir: str) -> int:
+    """
+    Get the size of the objects fetched into a work directory's repository,
+    i.e. what was transferred, as fetches keep the packs they receive.
+    """
+    from os import path, walk
+
+    objects_dir = path.join(work_dir, ".git", "objects")
+    return sum(path.getsize(path.join(root, file))
+               for root, _, files in walk(objects_dir) for file in files
+               if not file.endswith(('.idx', '.rev', '.keep', '.promisor', '.bitmap'))
+               and root != path.join(objects_dir, "info"))
+
+
+def fetchCommit(git_url: str, commit: str, work_dir: str, log: Callable):
+    """
+    Fetch a single commit into an empty repository in work_dir and check it
+    out, without its history. Servers that refuse to fetch a commit by hash
+    get a partial clone instead, which downloads every commit and tree but
+    only the files of the commit checked out, and failing that a full clone.
+    """
+    from re import fullmatch
+    from os import path
+    from shutil import rmtree
+    from git import Repo, GitCommandError
+
+    def reason(err: GitCommandError) -> str:
+        return str(err.stderr).strip().removeprefix("stderr: ").strip("'")
+
+    # The commit comes from amor.toml or amor.lock, and is checked out below, so
+    # it must not be readable as an option. The URL is given after `--`.
+    if not fullmatch(r'[0-9a-f]{4,64}', commit):
+        raise ValueError(f'"{commit}" is not a commit hash')
+
+    try:
+        r = Repo.init(work_dir)
+        # Keep fetched packs as they are, so their size is what was transferred
+        with r.config_writer() as writer:
+            writer.set_value("fetch", "unpackLimit", 1)
+        r.git.fetch('--depth', '1', '--no-tags', '--', git_url, commit)
+        r.git.checkout('-q', 'FETCH_HEAD')
+        return
+    except GitCommandError as err:
+        log(f'Could not fetch {commit} by hash, falling back to a partial clone...')
+        log(reason(err))
+
+    try:
+        rmtree(work_dir)
+        r = Repo.clone_from(git_url, to_path=work_dir, no_checkout=True,
+                            multi_options=['--filter=blob:none',
+                                           '--config=fetch.unpackLimit=1'],
+                            allow_unsafe_options=True)
+        r.git.checkout('-q', commit)
+        return
+    except GitCommandError as err:
+        log('Partial clone failed, falling back to a full clone...')
+        log(reason(err))
+
+    if path.exists(work_dir):
+        rmtree(work_dir)
+    r = Repo.clone_from(git_url, to_path=work_dir, no_checkout=True)
+    r.git.checkout('-q', commit)
+
+
+def installModule(module: str, pinned: str | None, lua_version: str,
+                  log: Callable, method: str | None = None,
+                  ref_ttl: float = 0) -> dict:
+    """
+    Fetch and build one module, given as `<username>/<repository>[@<tag>]`
+    or `<url>[@<tag>]`, in its own work directory, so several can be
+    installed at once. The tag, or branch, is looked up in the remote's refs,
+    cached for ref_ttl seconds. A pinned hash from amor.toml or amor.lock is
+    checked out instead, without looking up the refs. Modules already in the user cache
+    for the commit and Lua version, and method if given, are placed from
+    there instead, so pinned ones need no network. Returns the name,
+    repository, tag, commit and build method of the installed module, and
+    the cache entry it was placed from, if any.
+    """
+    from os import path, makedirs
+    from shutil import rmtree
+
+    from utils import getRemoteRefs, getRepoUrl
+    from cache import findCachedModule, materializeModule, storeModule, formatSize
+
+    log('Installing', module+"...")
+
+    tag = None
+    repo = module
+    if '@' in module:
+        repo, tag = module.split('@')
+    mod_name = repo.split('/')[-1].removesuffix('.git')
+
+    if tag == 'None':
+        tag = None
+
+    git_url = getRepoUrl(repo)
+
+    hash = ''
+    if pinned is not None:
+        hash = pinned
+    else:
+        refs = getRemoteRefs(git_url, ref_ttl)
+        if tag is not None and tag not in refs["tags"] and tag not in refs["heads"]\
+                and refs["cached"]:
+            # May have been pushed since the refs were cached
+            refs = getRemoteRefs(git_url)
+        if tag is not None and tag in refs["tags"]:
+            hash = refs["tags"][tag]
+        elif tag is not None and tag in refs["heads"]:
+            hash = refs["heads"][tag]
+        else:
+            if tag is not None:
+                log(f"{tag} not found, installing the latest commit")
+            hash = refs["head"]
+        if hash is None:
+            raise ValueError(f"{git_url} has no HEAD to install")
+    log(tag, hash)
+
+    entry = findCachedModule(repo, hash, lua_version, method)
+    if entry is not None:
+        meta = materializeModule(entry)
+        log(f"Installed {meta['name']} from cache!")
+        return {"name": meta["name"], "repo": repo, "tag": tag, "commit": hash,
+                "method": meta["method"], "cached": entry}
+
+    work_dir = f"./.amor/tmp/{repo.replace('://', '_').replace('/', '_')}"
+    if path.exists(work_dir):
+        rmtree(work_dir)
+    makedirs('./.amor/tmp', exist_ok=True)
+
+    try:
+        fetchCommit(git_url, hash, work_dir, log)
+        log(f"Fetched {formatSize(fetchedBytes(work_dir))}")
+
+        mod_name, built = buildModule(work_dir, mod_name, log)
+    finally:
+        if path.exists(work_dir):
+            rmtree(work_dir)
+
+    if method is not None and built != method:
+        raise ValueError(f"{mod_name} was built from {built}, amor.lock expects {method}")
+
+    try:
+        storeModule(f"./.amor/{mod_name}", repo, hash, lua_version, built, mod_name)
+    except OSError as err:
+        log(f"Could not cache {mod_name}: {err}")
+
+    log(f"Installed {mod_name}!")
+    return {"name": mod_name, "repo": repo, "tag": tag, "commit": hash, "method": built,
+            "cached": None}
+
+
+def lockMismatches(deps: dict[str, str], lock: dict, lua_version: str) -> list[str]:
+    """
+    Find the modules whose amor.toml entry does not match amor.lock.
+    """
+    stale = [name for name in lock["modules"] if name not in deps]
+    for name, dep in deps.items():
+        entry = lock["modules"].get(name)
+        repo_tag, commit = dep.split('=')
+        if entry is None or entry["repo"] != repo_tag.split('@')[0]\
+                or entry["commit"] != commit or lock["lua_version"] != lua_version:
+            stale.append(name)
+    return sorted(stale)
 
-    from utils import getRepoHeadHash, getRepoTagHashes, include_patterns, remove_empty_dirs
+
+def installOpt(args: Namespace):
+    """
+    Install given repositor(y/ies) or all repositories in the project amor.toml.
+    With --jobs, modules are fetched and built concurrently, and the output
+    of each is printed together once it is done. amor.lock records what was
+    installed, and with --frozen, exactly that is installed and checked.
+    """
+    from os import listdir, path, cpu_count
+    from shutil import rmtree
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from toml import load, dump
+    from lock import loadLock, saveLock, hashModule, verifyModule
 
     modules: list[str] = args.module
-    
+
     hashes = {}
+    methods = {}
+
+    with open('amor.toml', 'r') as amor_conf:
+        conf = load(amor_conf)
+    lua_version = conf["project"].get("lua_version", "5.4")
+    lock = loadLock()
+
+    if args.frozen:
+        if len(modules) > 0:
+            print('--frozen only installs the modules in amor.lock')
+            raise SystemExit(1)
+        if lock is None:
+            print('No amor.lock found, run `amor install` first')
+            raise SystemExit(1)
+        stale = lockMismatches(conf["dependencies"] or {}, lock, lua_version)
+        if len(stale) > 0:
+            print('amor.lock does not match amor.toml for', *stale)
+            raise SystemExit(1)
 
     if args.force:
         for dir in listdir('./.amor'):
@@ -34,176 +341,127 @@ def installOpt(args: Namespace):
             except:
                 print(f'Failed to delete {dir}')
 
-    if len(modules) == 0:
+    if args.frozen:
+        print('Installing from amor.lock...')
+        for mod, entry in lock["modules"].items(): # type: ignore
+            if path.exists(f"./.amor/{mod}")\
+                    and len(verifyModule(f"./.amor/{mod}", entry["files"])) == 0:
+                print(f"{mod} already installed!")
+                continue
+            modules.append(f"{entry['repo']}@{entry.get('tag', 'None')}")
+            hashes[entry["repo"]] = entry["commit"]
+            methods[entry["repo"]] = entry.get("method")
+
+    elif len(modules) == 0:
         print('Installing from amor.toml...')
-        with open('amor.toml', 'r') as amor_conf:
-            conf = load(amor_conf)
 
         found_mods: dict[str, str] = conf["dependencies"]
         for mod in found_mods.keys():
             if path.exists(f"./.amor/{mod}"):
                 print(f"{mod} already installed!")
                 continue
-            
+
             mod_name, mod_hash = conf["dependencies"][mod].split('=')
             modules.append(mod_name)
             mod_name = mod_name.split('@')[0]
             hashes[mod_name] = mod_hash
             print(mod_name, mod_hash)
 
-
-    for module in modules:
-        print('Installing', module+"...")
-        if path.exists('./.amor/tmp/'):
-            rmtree('./.amor/tmp/')
-
-        tag = None
-        repo = module
-        if '@' in module:
-            repo, tag = module.split('@')
-        mod_name = repo.split('/')[-1]
-    
-        if tag == 'None':
-            tag = None
-
-        git_url = f"https://github.com/{repo}.git"
-        tags = getRepoTagHashes(git_url)
-
-        hash = ''
-        if tag != None and tag in tags.keys():
-            hash = tags[tag]
-        else:
-            hash = getRepoHeadHash(git_url)
-        print(tag, hash)
-        
-        if len(hashes.keys()) > 0:
-            try:
-                r = Repo.clone_from(git_url, to_path='./.amor/tmp/')
-                r.index.reset(commit=hashes[repo], working_tree=True)
-            except KeyError:
-                print('Something went wrong resetting the HEAD!')
-        else:
-            Repo.clone_from(git_url, to_path="./.amor/tmp/", branch=tag,
-                        depth=1)
-        
-        dir_content = listdir('./.amor/tmp')
-        rockspecs = [file for file in dir_content if file.endswith('.rockspec')]
-        makefiles = [file for file in dir_content if "Makefile" in file]
-        
-        built_from_spec = False
-        built_from_rockspec = False
-        built_from_makefile = False
+    # Each module's output is kept until it is done, unless there is only
+    # one at a time
+    jobs = args.jobs if args.jobs > 0 else (cpu_count() or 1)
+    jobs = min(jobs, max(1, len(modules)))
+
+    def install(module: str) -> tuple[dict | None, list[str]]:
+        lines: list[str] = []
+        def log(*values):
+            if jobs > 1:
+                lines.append(' '.join(str(value) for value in values))
+            else:
+                print(*values)
+        repo = module.split('@')[0]
         try:
-            if len(rockspecs) > 0:
-                print('Building from Rockspec...')
-                res = cmd(["luarocks", "build", rockspecs[0], f'--tree="build"',], cwd="./.amor/tmp/",
-                      stdout=PIPE, text=True)
-
-                for line in res.stdout.splitlines(): print(line)
-
-                res.check_returncode()
-            
-                with open(f"./.amor/tmp/{rockspecs[0]}", 'r') as rs:
-                    rspec = rs.readlines()
-
-                rspec.append(
-                        "if build and package then return { package = package,\
-                                                           modules = build.modules} end\n"
-                        )
-                lua = LuaRuntime()
-                build_modules = dict(lua.execute(''.join(rspec))) # type: ignore
-                print(build_modules)
-                mods: list[str] = [mod for mod in build_modules["modules"]] # type: ignore
-                package: str | None = build_modules['package'] # type: ignore
-
-                print(*mods)
-                print(build_modules["package"]) # type: ignore
-                has_package = package is not None
-                renamed_mod = list(filter(lambda m: '.' not in m, mods))
-                mismatch_module_name = len(renamed_mod) != 0 and package not in renamed_mod
-                print(*renamed_mod)
-
-                if has_package:
-                    print('has package', package)
-                    mod_name = package
-                if mismatch_module_name:
-                    print('but has mismatch', renamed_mod[0])
-                    mod_name = renamed_mod[0]
-                if not has_package and not mismatch_module_name and len(mods) > 0:
-                    print('fallback')
-                    mod_name = mods[0]
-
-                if path.exists(f"./.amor/{mod_name}"):
-                    rmtree(f"./.amor/{mod_name}")
-
-                cwd = getcwd()
-                try:
-                    copytree(f"{cwd}/.amor/tmp/build/lib/lua/5.4/", f"{cwd}/.amor/{mod_name}/")
-                except:
-                    print("Default build location not found, trying fallback...")
-                    try:
-                        copytree(f"{cwd}/.amor/tmp/build/share/lua/5.4/{mod_name}/",
-                             f"{cwd}/.amor/{mod_name}/")
-                    except:
-                        print(f"Uh oh! {mod_name} could not be built!")
-                        raise
-                built_from_rockspec = True
-
-            elif len(makefiles) > 0:
-                print('Building from Makefile...')
-                for makefile in makefiles:
-                    with open(f"./.amor/tmp/{makefile}", "r") as mf:
-                        lines = mf.readlines()
-
-                    for i in range(len(lines)):
-                        if 'config' in lines[i] or 'CONFIG' in lines[i]:
-                            lines[i] = f"# {lines[i]}"
-
-                    with open(f"./.amor/tmp/{makefile}", "w") as mf:
-                        mf.writelines(lines)
-
-                LUA_INCLUDE = environ.copy()["LUA_INCLUDE"]
-                print(LUA_INCLUDE)
-                res = cmd(["make", f"--include-dir={LUA_INCLUDE}"], stdout=PIPE,
-                          shell=True, text=True, cwd='./.amor/tmp/')
-            
-                for line in res.stdout.splitlines(): print(line)
-
-                res.check_returncode()
-                built_from_makefile = True
-        except:
-            print('Something went wrong whilst building, attempting source \
-                  copy...')
-        else:
-            print('No errors!')
-            built_from_spec = built_from_rockspec or built_from_makefile
-        finally:
-            print('Final checks...')
-            if not built_from_spec:
-                print('No build option found! Copying files...')
-
-                if path.exists(f"./.amor/{mod_name}"):
-                    rmtree(f"./.amor/{mod_name}")
-
-                copytree("./.amor/tmp", f"./.amor/{mod_name}",
-                        ignore=include_patterns("*.lua", "*.so"))
-
-                remove_empty_dirs(f"./.amor/{mod_name}/")
-        
+            result = installModule(module, hashes.get(repo), lua_version, log,
+                                   methods.get(repo), args.ref_ttl)
+            if args.frozen:
+                entry = lock["modules"].get(result["name"], {}) # type: ignore
+                changed = verifyModule(f"./.amor/{result['name']}", entry.get("files", {}))
+                if len(changed) > 0 and result["cached"] is not None:
+                    # Hardlinked files edited in place change the cache too
+                    log('Cached files differ from amor.lock, fetching again...')
+                    rmtree(result["cached"])
+                    result = installModule(module, hashes.get(repo), lua_version, log,
+                                           methods.get(repo))
+                    changed = verifyModule(f"./.amor/{result['name']}", entry.get("files", {}))
+                if len(changed) > 0:
+                    raise ValueError(f"checksums differ from amor.lock for {', '.join(changed)}")
+        except Exception as err:
+            log(f'Failed to install {module}: {err}')
+            result = None
+        return result, lines
+
+    installed: dict[str, dict] = {}
+    failed: list[str] = []
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(install, module): module for module in modules}
+        for fut in as_completed(futures):
+            module = futures[fut]
+            result, lines = fut.result()
+            if jobs > 1:
+                print(f"==> {module}")
+                for line in lines: print(f"    {line}")
+            if result is None:
+                failed.append(module)
+            else:
+                installed[result["name"]] = result
+
+    if path.exists('./.amor/tmp') and len(listdir('./.amor/tmp')) == 0:
         rmtree('./.amor/tmp')
 
+    if args.frozen:
+        if len(failed) > 0:
+            print('Failed to install', *failed)
+            raise SystemExit(1)
+        return
+
+    if len(installed) > 0:
         with open('amor.toml', 'r') as amor_conf:
             conf = load(amor_conf)
 
         if conf['dependencies'] is None:
             conf['dependencies'] = {}
 
-        conf['dependencies'][mod_name] = f"{repo}@{tag}={hash}"
+        for mod_name, result in installed.items():
+            conf['dependencies'][mod_name] = f"{result['repo']}@{result['tag']}={result['commit']}"
 
         with open('amor.toml', 'w') as amor_conf:
             dump(conf, amor_conf)
 
-        print(f"Installed {mod_name}!")
+    # Lock what amor.toml lists. Modules installed before keep their entry,
+    # or get one without a build method if they have none.
+    deps: dict[str, str] = conf['dependencies'] or {}
+    if len(deps) > 0 or lock is not None:
+        previous = lock["modules"] if lock is not None and lock["lua_version"] == lua_version else {}
+        locked = {}
+        for mod_name, dep in deps.items():
+            repo_tag, commit = dep.split('=')
+            entry = previous.get(mod_name, {})
+            if not path.exists(f"./.amor/{mod_name}"):
+                continue
+            if mod_name not in installed and entry.get("commit") == commit:
+                locked[mod_name] = entry
+                continue
+            repo, tag = (repo_tag.split('@') + ['None'])[:2]
+            entry = {"repo": repo, "commit": commit}
+            if tag != 'None':
+                entry["tag"] = tag
+            if mod_name in installed:
+                entry["method"] = installed[mod_name]["method"]
+            entry["files"] = hashModule(f"./.amor/{mod_name}")
+            locked[mod_name] = entry
+        saveLock({"lua_version": lua_version, "modules": locked})
+
+    if len(failed) > 0:
+        print('Failed to install', *failed)
+        raise SystemExit(1)
     return
-
-
@@ -0,0 +1,67 @@
+# amor.lock functions
+
+# Bump when the layout of amor.lock changes
+LOCK_VERSION = 1
+
+LOCK_PATH = 'amor.lock'
+
+
+def loadLock(lock_path: str = LOCK_PATH) -> dict | None:
+    """
+    Load the lockfile, or None if there is none or it is from another
+    version of amor.
+    """
+    from os import path
+    from toml import load
+
+    if not path.exists(lock_path):
+        return None
+    with open(lock_path, 'r') as lock_file:
+        lock = load(lock_file)
+    if lock.get("version") != LOCK_VERSION:
+        return None
+    lock.setdefault("modules", {})
+    return lock
+
+
+def saveLock(lock: dict, lock_path: str = LOCK_PATH):
+    """
+    Write the lockfile, with modules and files in a stable order so it diffs
+    cleanly.
+    """
+    from toml import dump
+
+    modules = {}
+    for name in sorted(lock["modules"]):
+        entry = dict(lock["modules"][name])
+        entry["files"] = dict(sorted(entry.get("files", {}).items()))
+        modules[name] = entry
+    with open(lock_path, 'w') as lock_file:
+        lock_file.write("# Generated by amor install, do not edit\n")
+        dump({"version": LOCK_VERSION, "lua_version": lock["lua_version"],
+              "modules": modules}, lock_file)
+
+
+def hashModule(mod_dir: str) -> dict[str, str]:
+    """
+    Get the checksum of every file of an installed module, by path.
+    """
+    from os import path, walk
+    from manifest import hashFile
+
+    files = {}
+    for root, _, names in walk(mod_dir):
+        for name in names:
+            file_path = path.join(root, name)
+            files[path.relpath(file_path, mod_dir).replace(path.sep, '/')] = hashFile(file_path)
+    return files
+
+
+def verifyModule(mod_dir: str, files: dict[str, str]) -> list[str]:
+    """
+    Compare an installed module's files with the checksums of its lock
+    entry. Returns the paths that are missing, changed or not in the lock.
+    """
+    actual = hashModule(mod_dir)
+    return sorted(rel_path for rel_path in set(actual) | set(files)
+                  if actual.get(rel_path) != files.get(rel_path))
@@ -1,4 +1,5 @@
 from argparse import ArgumentParser, Namespace
+from multiprocessing import freeze_support
 
 from new import newOpt
 from init import initOpt
@@ -7,6 +8,9 @@ from uninstall import uninstallOpt
 from run import runOpt
 from build import buildOpt
 from love import loveOpt
+from dev import devOpt
+from package import packageOpt
+from cache import cacheLsOpt, cachePruneOpt
 
 # amor version
 __version__ = '0.4.0'
@@ -59,6 +63,18 @@ install.add_argument("module", nargs="*", type=str, help="Module(s) to install\
                      the most current version will be installed. If <tag> is\
                      present, but does not exist on repository, the most\
                      current version will be installed.")
+install.add_argument("--jobs", "-j", type=int, default=1, help="Number of\
+                     modules fetched and built at once, each in its own work\
+                     directory. 0 uses one per CPU core.")
+install.add_argument("--frozen", action="store_true", help="Install exactly\
+                     the modules and commits recorded in amor.lock, without\
+                     looking up tags or branches, and check the installed\
+                     files against its checksums. Fails if amor.lock does\
+                     not match amor.toml.")
+install.add_argument("--ref-ttl", type=float, default=300, metavar="SECONDS",
+                     help="How long the tags and branches looked up from a\
+                     module's repository are reused for, from the user\
+                     cache. 0 always looks them up again.")
 install.set_defaults(func=installOpt)
 
 # Uninstall
@@ -80,6 +96,19 @@ build = subparsers.add_parser("build", aliases=["b"], help="Build project into\
         single directory for Löve.")
 build.add_argument("--clean", "-c", action="store_true", help="Remove existing\
                    build folder contents.")
+build.add_argument("--jobs", "-j", type=int, default=1, help="Number of\
+                   worker processes used to parse and emit Lua files. 0 uses\
+                   one per CPU core.")
+build.add_argument("--graph", type=str, metavar="PATH", help="Write the\
+                   project's module graph, with fan-in and fan-out of each\
+                   module, to a JSON file.")
+build.add_argument("--watch", "-w", action="store_true", help="Keep running\
+                   and rebuild the changed files whenever the source,\
+                   installed modules or amor.toml change.")
+build.add_argument("--bundle", action="store_true", help="Bundle the project's\
+                   Lua modules and installed modules into the entry file,\
+                   registered in package.preload, so that starting the game\
+                   reads a single file.")
 build.set_defaults(func=buildOpt)
 
 # Love
@@ -87,6 +116,42 @@ love = subparsers.add_parser("love", help="Run Löve using the current project's
         build directory.")
 love.set_defaults(func=loveOpt)
 
-args = parser.parse_args()
-args.func(args)
+# Dev
+dev = subparsers.add_parser("dev", help="Build the project and run it in Löve,\
+        rebuilding on change and hot-swapping changed modules.")
+dev.add_argument("--jobs", "-j", type=int, default=1, help="Number of worker\
+                 processes used to parse and emit Lua files. 0 uses one per\
+                 CPU core.")
+dev.set_defaults(func=devOpt, graph=None, bundle=False)
+
+# Package
+package = subparsers.add_parser("package", aliases=["p"], help="Package the\
+        project build directory into a .love archive.")
+package.add_argument("--output", "-o", type=str, metavar="PATH", help="Path of\
+                     the archive. Defaults to ./dist/<name>.love.")
+package.add_argument("--jobs", "-j", type=int, default=0, help="Number of\
+                     threads used to compress files. 0 uses one per CPU core.")
+package.set_defaults(func=packageOpt)
+
+# Cache
+cache = subparsers.add_parser("cache", help="Manage the cache of installed\
+        modules shared between projects.")
+cache.set_defaults(func=cacheLsOpt)
+cache_commands = cache.add_subparsers(help="Cache commands")
+cache_ls = cache_commands.add_parser("ls", help="List the cached modules, most\
+        recently used first.")
+cache_ls.set_defaults(func=cacheLsOpt)
+cache_prune = cache_commands.add_parser("prune", help="Remove the least\
+        recently used modules until the cache fits in --max-size.")
+cache_prune.add_argument("--max-size", "-s", type=str, default="1G", help="Size\
+                         to shrink the cache to, e.g. 500M or 2G.")
+cache_prune.add_argument("--all", "-a", action="store_true", help="Remove\
+                         every cached module.")
+cache_prune.set_defaults(func=cachePruneOpt)
+
+if __name__ == '__main__':
+    # Needed for build worker processes in the pyinstaller executable
+    freeze_support()
+    args = parser.parse_args()
+    args.func(args)
 
@@ -0,0 +1,87 @@
+# Build manifest functions
+
+# Bump when the layout of the manifest or the emitted output changes so that
+# stale records from older builds are discarded.
+MANIFEST_VERSION = 5
+
+
+def hashContent(content: bytes):
+    """
+    Get the content hash used to detect changed files between builds.
+    """
+    from hashlib import sha256
+    return sha256(content).hexdigest()
+
+
+def hashFile(file_path: str):
+    """
+    Get the content hash of a file without reading it into memory at once.
+    """
+    from hashlib import sha256
+
+    digest = sha256()
+    with open(file_path, 'rb') as content:
+        for chunk in iter(lambda: content.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hashDir(dir_path: str):
+    """
+    Get a signature of a directory's file names, sizes and mtimes, used to
+    detect changed directories without reading their contents.
+    """
+    from hashlib import sha256
+    from os import walk, stat, path
+
+    digest = sha256()
+    for root, dirs, files in walk(dir_path):
+        dirs.sort()
+        for file in sorted(files):
+            st = stat(path.join(root, file))
+            digest.update(f"{path.relpath(path.join(root, file), dir_path)}\0"
+                          f"{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def loadManifest(manifest_path: str):
+    """
+    Load the build manifest, or an empty one if it is missing or out of date.
+    """
+    from json import load, JSONDecodeError
+    from os import path
+
+    empty = {"version": MANIFEST_VERSION, "files": {}, "assets": {}, "ext": {},
+             "atlas": {}, "transforms": {}}
+
+    if not path.exists(manifest_path):
+        return empty
+
+    try:
+        with open(manifest_path, 'r') as manifest_file:
+            manifest = load(manifest_file)
+    except (OSError, JSONDecodeError):
+        print('Build manifest unreadable, rebuilding everything...')
+        return empty
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        return empty
+
+    manifest.setdefault("assets", {})
+    manifest.setdefault("ext", {})
+    manifest.setdefault("atlas", {})
+    manifest.setdefault("transforms", {})
+    return manifest
+
+
+def saveManifest(manifest_path: str, manifest: dict):
+    """
+    Write the build manifest, replacing the previous one atomically.
+    """
+    from json import dump
+    from os import replace
+
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, 'w') as manifest_file:
+        dump(manifest, manifest_file, indent=2, sort_keys=True)
+    replace(tmp_path, manifest_path)
@@ -0,0 +1,419 @@
+# Lua AST optimizer, for build.optimize
+
+# Globals whose fields may be hoisted into file-level locals, with the depth
+# of the paths hoisted, e.g. math.floor or love.graphics.draw
+hoist_roots = {"math": 2, "string": 2, "table": 2, "love": 3}
+
+# At most this many locals are hoisted per file, well within Lua's limits of
+# 200 locals and 60 upvalues per function
+MAX_HOISTED = 16
+
+# Fields of nodes that hold names rather than expressions
+_name_fields = {
+        "Invoke": ["func"],
+        "Method": ["name"],
+        "Goto": ["label"],
+        "Label": ["id"],
+        }
+
+
+def _children(node) -> list[str]:
+    """
+    The fields of a node that hold child expressions or statements.
+    """
+    from luaparser import astnodes
+
+    skip = list(_name_fields.get(type(node).__name__, []))
+    if isinstance(node, astnodes.Index) and node.notation == astnodes.IndexNotation.DOT:
+        skip.append("idx")
+    elif isinstance(node, astnodes.Field) and not node.between_brackets:
+        skip.append("key")
+    return [key for key, value in vars(node).items()
+            if not key.startswith('_') and key != 'comments' and key not in skip
+            and isinstance(value, (astnodes.Node, list))]
+
+
+def _rewrite(node, fn):
+    """
+    Rewrite an AST bottom-up, in place: fn gets each node after its children
+    and returns its replacement. Statements replaced by None are removed.
+    """
+    from luaparser import astnodes
+
+    for key in _children(node):
+        value = getattr(node, key)
+        if isinstance(value, list):
+            value = [_rewrite(child, fn) if isinstance(child, astnodes.Node) else child
+                     for child in value]
+            setattr(node, key, [child for child in value if child is not None])
+        else:
+            setattr(node, key, _rewrite(value, fn))
+    return fn(node)
+
+
+def _walk(node, visit):
+    """
+    Call visit on every node top-down. Children are skipped when visit
+    returns False.
+    """
+    from luaparser import astnodes
+
+    if visit(node) is False:
+        return
+    for key in _children(node):
+        value = getattr(node, key)
+        for child in value if isinstance(value, list) else [value]:
+            if isinstance(child, astnodes.Node):
+                _walk(child, visit)
+
+
+def _dotted(node) -> str | None:
+    """
+    The path of a chain of dot indexes on a name, e.g. "love.graphics.draw",
+    or None for other expressions.
+    """
+    from luaparser import astnodes
+
+    parts = []
+    while isinstance(node, astnodes.Index):
+        if node.notation != astnodes.IndexNotation.DOT or not isinstance(node.idx, astnodes.Name):
+            return None
+        parts.append(node.idx.id)
+        node = node.value
+    if not isinstance(node, astnodes.Name):
+        return None
+    parts.append(node.id)
+    return '.'.join(reversed(parts))
+
+
+def _bindings(tree) -> tuple[set[str], set[str], set[str]]:
+    """
+    Find the names an AST declares as locals or parameters, the names and
+    dotted paths it assigns, and every name it uses.
+    """
+    from luaparser import ast, astnodes
+
+    bound: set[str] = set()
+    assigned: set[str] = set()
+    used: set[str] = set()
+    for node in ast.walk(tree): # type: ignore
+        targets = []
+        if isinstance(node, astnodes.Name):
+            used.add(node.id)
+        elif isinstance(node, (astnodes.LocalAssign, astnodes.Forin)):
+            bound.update(t.id for t in node.targets if isinstance(t, astnodes.Name))
+        elif isinstance(node, astnodes.Fornum):
+            bound.add(node.target.id)
+        elif isinstance(node, astnodes.LocalFunction):
+            bound.add(node.name.id)
+        elif isinstance(node, astnodes.Assign):
+            targets = node.targets
+        elif isinstance(node, astnodes.Function):
+            targets = [node.name]
+        elif isinstance(node, astnodes.Method):
+            path = _dotted(node.source)
+            if path is not None:
+                assigned.add(f"{path}.{node.name.id}")
+
+        if isinstance(node, (astnodes.Function, astnodes.LocalFunction,
+                             astnodes.Method, astnodes.AnonymousFunction)):
+            bound.update(arg.id for arg in node.args if isinstance(arg, astnodes.Name))
+        for target in targets:
+            path = _dotted(target)
+            if path is not None:
+                assigned.add(path)
+    return bound, assigned, used
+
+
+def _literal(value):
+    """
+    A literal node for a build.defines value.
+    """
+    from luaparser import astnodes
+    from bundle import luaString
+
+    if isinstance(value, bool):
+        return astnodes.TrueExpr() if value else astnodes.FalseExpr()
+    if isinstance(value, (int, float)):
+        return _number(value)
+    return astnodes.String(luaString(str(value).encode(), long=False)[1:-1],
+                           astnodes.StringDelimiter.DOUBLE_QUOTE)
+
+
+def _number(value):
+    """
+    A literal node for a number, negative numbers in parentheses so they
+    keep their precedence wherever they end up.
+    """
+    from luaparser import astnodes
+
+    if value < 0:
+        return astnodes.UMinusOp(astnodes.Number(-value), wrapped=True)
+    return astnodes.Number(value)
+
+
+def _constant(node) -> tuple[str, object] | None:
+    """
+    The Lua type and value of a literal node, or None if it is not one.
+    """
+    from luaparser import astnodes
+
+    if isinstance(node, astnodes.Nil):
+        return ("nil", None)
+    if isinstance(node, astnodes.TrueExpr):
+        return ("boolean", True)
+    if isinstance(node, astnodes.FalseExpr):
+        return ("boolean", False)
+    if isinstance(node, astnodes.Number) and not isinstance(node.n, bool):
+        return ("number", node.n)
+    if isinstance(node, astnodes.UMinusOp) and isinstance(node.operand, astnodes.Number):
+        return ("number", -node.operand.n)
+    if isinstance(node, astnodes.String):
+        return ("string", node.s)
+    return None
+
+
+def _arith(node, left, right):
+    """
+    Fold an arithmetic operation on two numbers, or return None where the
+    result could differ between Lua versions or from Python's.
+    """
+    from math import isfinite, pow
+    from luaparser import astnodes
+
+    ints = isinstance(left, int) and isinstance(right, int)
+    try:
+        if isinstance(node, astnodes.AddOp):
+            result = left + right
+        elif isinstance(node, astnodes.SubOp):
+            result = left - right
+        elif isinstance(node, astnodes.MultOp):
+            result = left * right
+        elif isinstance(node, astnodes.FloatDivOp) and right != 0:
+            result = float(left) / right
+        elif isinstance(node, astnodes.ExpoOp):
+            result = pow(left, right)
+        elif isinstance(node, astnodes.ModOp) and ints and right != 0:
+            result = left % right
+        else:
+            return None
+    except (ValueError, OverflowError):
+        return None
+    if not isfinite(result) or (isinstance(result, int) and abs(result) >= 2 ** 53):
+        return None
+    return result
+
+
+def _truthy(const: tuple[str, object]) -> bool:
+    return const[0] != "nil" and const != ("boolean", False)
+
+
+def _fold(node):
+    """
+    Fold a node whose operands are literals, and prune the branches of ifs
+    and loops whose conditions are. Returns the replacement node.
+    """
+    from re import search
+    from luaparser import astnodes
+
+    wrapped = getattr(node, 'wrapped', False)
+
+    # A literal called or indexed, e.g. after substituting a define, needs
+    # parentheses to be valid syntax
+    target = {"Call": "func", "Invoke": "source", "Index": "value"}.get(type(node).__name__)
+    if target is not None and _constant(getattr(node, target)) is not None:
+        getattr(node, target).wrapped = True
+
+    if isinstance(node, (astnodes.AndLoOp, astnodes.OrLoOp)):
+        left = _constant(node.left)
+        if left is None:
+            return node
+        keep_left = _truthy(left) != isinstance(node, astnodes.AndLoOp)
+        result = node.left if keep_left else node.right
+        # `a and f()` gives only the first result of f
+        if isinstance(result, (astnodes.Call, astnodes.Invoke, astnodes.Varargs)):
+            wrapped = True
+        result.wrapped = wrapped or result.wrapped
+        return result
+
+    if isinstance(node, astnodes.ULNotOp):
+        operand = _constant(node.operand)
+        if operand is None:
+            return node
+        return astnodes.FalseExpr() if _truthy(operand) else astnodes.TrueExpr()
+
+    if isinstance(node, astnodes.UMinusOp) and not isinstance(node.operand, astnodes.Number):
+        operand = _constant(node.operand)
+        if operand is None or operand[0] != "number":
+            return node
+        result = _number(-operand[1]) # type: ignore
+        result.wrapped = wrapped or result.wrapped
+        return result
+
+    if isinstance(node, astnodes.Concat):
+        left, right = node.left, node.right
+        if isinstance(left, astnodes.String) and isinstance(right, astnodes.String)\
+                and left.delimiter == right.delimiter\
+                and left.delimiter != astnodes.StringDelimiter.DOUBLE_SQUARE\
+                and not (search(r'\\\d{1,2}$', left.s) and right.s[:1].isdigit())\
+                and not search(r'\\z$', left.s):
+            return astnodes.String(left.s + right.s, left.delimiter, wrapped=wrapped)
+        return node
+
+    if isinstance(node, (astnodes.EqToOp, astnodes.NotEqToOp)):
+        left, right = _constant(node.left), _constant(node.right)
+        if left is None or right is None:
+            return node
+        if left[0] == "string" and right[0] == "string"\
+                and ('\\' in left[1] or '\\' in right[1]): # type: ignore
+            return node
+        equal = left == right or (left[0] == right[0] == "number" and left[1] == right[1])
+        if isinstance(node, astnodes.NotEqToOp):
+            equal = not equal
+        return astnodes.TrueExpr() if equal else astnodes.FalseExpr()
+
+    if isinstance(node, (astnodes.LessThanOp, astnodes.GreaterThanOp,
+                         astnodes.LessOrEqThanOp, astnodes.GreaterOrEqThanOp)):
+        left, right = _constant(node.left), _constant(node.right)
+        if left is None or right is None or left[0] != "number" or right[0] != "number":
+            return node
+        a, b = left[1], right[1]
+        result = {
+                astnodes.LessThanOp: lambda: a < b, # type: ignore
+                astnodes.GreaterThanOp: lambda: a > b, # type: ignore
+                astnodes.LessOrEqThanOp: lambda: a <= b, # type: ignore
+                astnodes.GreaterOrEqThanOp: lambda: a >= b, # type: ignore
+                }[type(node)]()
+        return astnodes.TrueExpr() if result else astnodes.FalseExpr()
+
+    if isinstance(node, astnodes.AriOp):
+        left, right = _constant(node.left), _constant(node.right)
+        if left is None or right is None or left[0] != "number" or right[0] != "number":
+            return node
+        result = _arith(node, left[1], right[1])
+        if result is None:
+            return node
+        folded = _number(result)
+        folded.wrapped = wrapped or folded.wrapped
+        return folded
+
+    # Dead branches. A branch that is always taken keeps its own scope.
+    if isinstance(node, (astnodes.If, astnodes.ElseIf)):
+        test = _constant(node.test)
+        if test is None:
+            return node
+        if _truthy(test):
+            return astnodes.Do(node.body) if isinstance(node, astnodes.If) else node.body
+        orelse = node.orelse
+        if not isinstance(node, astnodes.If) or orelse is None:
+            return orelse
+        if isinstance(orelse, astnodes.ElseIf):
+            return astnodes.If(orelse.test, orelse.body, orelse.orelse)
+        return astnodes.Do(orelse)
+
+    if isinstance(node, astnodes.While):
+        test = _constant(node.test)
+        if test is not None and not _truthy(test):
+            return None
+        return node
+
+    return node
+
+
+def _hoist(tree, bound: set[str], assigned: set[str], used: set[str]) -> str:
+    """
+    Replace the global paths of hoist_roots used more than once in an AST
+    with file-level locals, in place. Returns the declaration of the locals,
+    on one line so line numbers are kept.
+    """
+    from luaparser import ast, astnodes
+
+    # Modules like love.timer may only be loaded by the file itself, e.g. in
+    # threads, so they are looked up where they are used
+    required: set[str] = set()
+    for node in ast.walk(tree): # type: ignore
+        if isinstance(node, astnodes.Call) and isinstance(node.func, astnodes.Name)\
+                and node.func.id == 'require' and len(node.args) > 0\
+                and isinstance(node.args[0], astnodes.String):
+            required.add(node.args[0].s)
+
+    counts: dict[str, int] = {}
+
+    def count(node) -> bool:
+        path = _dotted(node)
+        if path is None:
+            return True
+        parts = path.split('.')
+        if hoist_roots.get(parts[0]) == len(parts):
+            counts[path] = counts.get(path, 0) + 1
+            return False
+        return True
+
+    _walk(tree, count)
+
+    def hoistable(path: str) -> bool:
+        parts = path.split('.')
+        return counts[path] > 1 and parts[0] not in bound\
+            and not any(path == a or path.startswith(f"{a}.") for a in assigned)\
+            and not (parts[0] == 'love' and '.'.join(parts[:2]) in required)
+
+    paths = sorted((p for p in counts if hoistable(p)), key=lambda p: (-counts[p], p))
+    if len(paths) == 0:
+        return ''
+
+    names: dict[str, str] = {}
+    for path in sorted(paths[:MAX_HOISTED]):
+        name = f"_amor_{path.replace('.', '_')}"
+        while name in used:
+            name += '_'
+        names[path] = name
+
+    def replace(node):
+        path = _dotted(node)
+        if path in names:
+            return astnodes.Name(names[path], wrapped=getattr(node, 'wrapped', False))
+        return node
+
+    _rewrite(tree, replace)
+
+    values = []
+    for path in names:
+        parts = path.split('.')
+        # Löve modules can be disabled in conf.lua, or not loaded in threads
+        guards = ['.'.join(parts[:i]) for i in range(1, len(parts))] if parts[0] == 'love' else []
+        values.append(' and '.join(guards + [path]))
+    return f"local {', '.join(names.values())} = {', '.join(values)} "
+
+
+def optimizeTree(tree, defines: dict, hoist: bool = True) -> str:
+    """
+    Optimize an AST in place: substitute the build.defines values for the
+    globals they name, fold constant expressions, remove branches that can
+    never run, e.g. `if DEBUG then` with DEBUG = false, and with hoist,
+    hoist global library functions used more than once into locals.
+    Globals the file assigns are left alone, and those it also declares as
+    locals are declared as file-level locals instead of substituted, so the
+    declarations shadow them as usual. Returns the code to put before the
+    emitted source.
+    """
+    from luaparser import ast, astnodes
+
+    bound, assigned, used = _bindings(tree)
+    defined = {name: value for name, value in defines.items()
+               if name not in assigned}
+    shadowed = [name for name in sorted(defined) if name in bound]
+    prelude = ''
+    if len(shadowed) > 0:
+        values = [ast.to_lua_source(_literal(defined[name])) for name in shadowed]
+        prelude = f"local {', '.join(shadowed)} = {', '.join(values)} "
+
+    def fold(node):
+        if isinstance(node, astnodes.Name) and node.id in defined\
+                and node.id not in shadowed:
+            literal = _literal(defined[node.id])
+            literal.wrapped = literal.wrapped or node.wrapped
+            return literal
+        return _fold(node)
+
+    _rewrite(tree, fold)
+    return prelude + (_hoist(tree, bound, assigned, used) if hoist else '')
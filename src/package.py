@@ -0,0 +1,225 @@
+from argparse import Namespace
+
+# Extensions stored without compression by default, as they are already
+# compressed
+default_store = [
+        ".png", ".jpg", ".jpeg", ".webp", ".ogg", ".oga", ".mp3", ".flac",
+        ".zip", ".love", ".gz",
+        ]
+
+# Every member gets the same timestamp (1980-01-01 00:00, the earliest a zip
+# can hold) so archives only differ when their contents do
+ZIP_TIME = 0
+ZIP_DATE = (1 << 5) | 1
+ZIP_MAX = 0xFFFFFFFF
+
+
+def readMember(src_path: str, method: int, level: int) -> tuple[int, int, bytes | None]:
+    """
+    Read a file to be packaged. Returns its CRC-32, size, and its deflated
+    data, or None for files to be stored, which are streamed in when written.
+    Files that do not get smaller when deflated are stored.
+    Run in a worker thread by packageOpt.
+    """
+    from zlib import crc32, compressobj, DEFLATED
+
+    crc = 0
+    size = 0
+    compressor = compressobj(level, DEFLATED, -15) if method == 8 else None
+    chunks: list[bytes] = []
+    with open(src_path, 'rb') as src:
+        for chunk in iter(lambda: src.read(1 << 20), b''):
+            crc = crc32(chunk, crc)
+            size += len(chunk)
+            if compressor is not None:
+                chunks.append(compressor.compress(chunk))
+
+    if compressor is None:
+        return crc, size, None
+    chunks.append(compressor.flush())
+    data = b''.join(chunks)
+    return crc, size, data if len(data) < size else None
+
+
+def readRawMember(archive_path: str, header_offset: int, compress_size: int) -> bytes:
+    """
+    Read the compressed data of a member from an existing zip archive.
+    """
+    from struct import unpack
+
+    with open(archive_path, 'rb') as archive:
+        archive.seek(header_offset)
+        header = archive.read(30)
+        name_len, extra_len = unpack('<HH', header[26:30])
+        archive.seek(header_offset + 30 + name_len + extra_len)
+        return archive.read(compress_size)
+
+
+def packageOpt(args: Namespace):
+    """
+    Package the project build directory into a .love archive.
+    """
+    from toml import load
+    from os import path, walk, stat, makedirs, replace, cpu_count
+    from json import load as jload, dump as jdump
+    from struct import pack
+    from zipfile import ZipFile, BadZipFile
+    from concurrent.futures import ThreadPoolExecutor
+    from collections import deque
+
+    from manifest import loadManifest
+
+    with open('amor.toml', 'r') as conf_file:
+        conf = load(conf_file)
+
+    build_dir = conf["project"]["build_dir"]
+    name = conf["project"].get("name") or "game"
+    package_conf = conf.get("package", {})
+    store = [ext.lower() for ext in package_conf.get("store", default_store)]
+    level = package_conf.get("level", 9)
+    out_path = args.output or f"./dist/{name}.love"
+
+    if not path.isdir(f"./{build_dir}"):
+        print(f"./{build_dir} not found, run `amor build` first")
+        return
+    if any(record.get("agent") for record in
+           loadManifest('./.bld/manifest.json')["files"].values()):
+        print(f"./{build_dir} was built by `amor dev`, run `amor build` first")
+        return
+
+    # Members in a fixed order, by path within the archive
+    members: list[tuple[str, str]] = []
+    for root, dirs, files in walk(f"./{build_dir}"):
+        dirs.sort()
+        for file in files:
+            src_path = path.join(root, file)
+            members.append((path.relpath(src_path, f"./{build_dir}")
+                            .replace(path.sep, '/'), src_path))
+    members.sort()
+
+    # Records of the previous archive, to reuse members whose source has not
+    # changed since
+    cache_path = './.bld/package.json'
+    cache: dict = {}
+    previous: dict = {}
+    if path.exists(cache_path) and path.exists(out_path):
+        with open(cache_path, 'r') as cache_file:
+            cache = jload(cache_file)
+        try:
+            with ZipFile(out_path) as old:
+                previous = {info.filename: info for info in old.infolist()}
+        except BadZipFile:
+            previous = {}
+    if cache.get("archive") != out_path:
+        cache = {}
+    old_members: dict = cache.get("members", {})
+    new_members: dict = {}
+
+    def prepare(member: tuple[str, str]):
+        arc_name, src_path = member
+        st = stat(src_path)
+        method = 0 if path.splitext(arc_name)[1].lower() in store else 8
+        record = {"size": st.st_size, "mtime": st.st_mtime_ns, "method": method,
+                  "level": level if method == 8 else 0}
+
+        old_record = old_members.get(arc_name)
+        info = previous.get(arc_name)
+        if old_record is not None and info is not None\
+                and {k: old_record.get(k) for k in record} == record\
+                and info.CRC == old_record["crc"] and info.compress_type in (0, method):
+            record["crc"] = info.CRC
+            if info.compress_type == 8:
+                data = readRawMember(out_path, info.header_offset, info.compress_size)
+                return record, data, True
+            return record, None, True
+
+        crc, size, data = readMember(src_path, method, level)
+        record["crc"] = crc
+        record["size"] = size
+        return record, data, False
+
+    makedirs(path.dirname(out_path) or '.', exist_ok=True)
+    tmp_path = f"{out_path}.tmp"
+    central: list[bytes] = []
+    reused = 0
+    workers = args.jobs if args.jobs > 0 else (cpu_count() or 1)
+
+    with open(tmp_path, 'wb') as archive, ThreadPoolExecutor(workers) as pool:
+        # Bounded look-ahead so large archives are not held in memory at once
+        pending = deque()
+        queue = iter(members)
+        for member in queue:
+            pending.append((member, pool.submit(prepare, member)))
+            if len(pending) >= workers * 2:
+                break
+
+        while len(pending) > 0:
+            (arc_name, src_path), fut = pending.popleft()
+            next_member = next(queue, None)
+            if next_member is not None:
+                pending.append((next_member, pool.submit(prepare, next_member)))
+
+            record, data, was_reused = fut.result()
+            reused += was_reused
+            new_members[arc_name] = record
+            size = record["size"]
+            compressed = len(data) if data is not None else size
+            offset = archive.tell()
+            name_bytes = arc_name.encode()
+
+            zip64 = size >= ZIP_MAX or compressed >= ZIP_MAX or offset >= ZIP_MAX
+            version = 45 if zip64 else 20
+            local_extra = pack('<HHQQ', 1, 16, size, compressed) if zip64 else b''
+            method = 8 if data is not None else 0
+            archive.write(pack('<IHHHHHIIIHH', 0x04034b50, version, 0x0800,
+                               method, ZIP_TIME, ZIP_DATE, record["crc"],
+                               ZIP_MAX if zip64 else compressed,
+                               ZIP_MAX if zip64 else size,
+                               len(name_bytes), len(local_extra)))
+            archive.write(name_bytes)
+            archive.write(local_extra)
+            if data is not None:
+                archive.write(data)
+            else:
+                with open(src_path, 'rb') as src:
+                    for chunk in iter(lambda: src.read(1 << 20), b''):
+                        archive.write(chunk)
+
+            central_extra = pack('<HHQQQ', 1, 24, size, compressed, offset)\
+                    if zip64 else b''
+            central.append(pack('<IHHHHHHIIIHHHHHII', 0x02014b50, 0x0300 | version,
+                                version, 0x0800, method, ZIP_TIME,
+                                ZIP_DATE, record["crc"],
+                                ZIP_MAX if zip64 else compressed,
+                                ZIP_MAX if zip64 else size,
+                                len(name_bytes), len(central_extra), 0, 0, 0,
+                                0o100644 << 16, ZIP_MAX if zip64 else offset)
+                           + name_bytes + central_extra)
+
+        cd_offset = archive.tell()
+        for entry in central:
+            archive.write(entry)
+        cd_size = archive.tell() - cd_offset
+
+        count = len(central)
+        if count >= 0xFFFF or cd_offset >= ZIP_MAX or cd_size >= ZIP_MAX:
+            eocd64_offset = archive.tell()
+            archive.write(pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0,
+                               count, count, cd_size, cd_offset))
+            archive.write(pack('<IIQI', 0x07064b50, 0, eocd64_offset, 1))
+            archive.write(pack('<IHHHHIIH', 0x06054b50, 0, 0, 0xFFFF, 0xFFFF,
+                               ZIP_MAX, ZIP_MAX, 0))
+        else:
+            archive.write(pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count,
+                               cd_size, cd_offset, 0))
+
+    replace(tmp_path, out_path)
+
+    makedirs('./.bld', exist_ok=True)
+    with open(cache_path, 'w') as cache_file:
+        jdump({"archive": out_path, "members": new_members}, cache_file,
+              indent=2, sort_keys=True)
+
+    print(f"Packaged {len(members)} files into {out_path}",
+          f"({reused} reused from the previous archive)")
+    return
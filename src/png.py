@@ -0,0 +1,204 @@
+# Minimal PNG reading and writing, for the asset pipeline
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def _paeth(a: int, b: int, c: int) -> int:
+    p = a + b - c
+    pa = abs(p - a)
+    pb = abs(p - b)
+    pc = abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    if pb <= pc:
+        return b
+    return c
+
+
+def _unfilter(data: bytes, height: int, stride: int, bpp: int) -> bytearray:
+    """
+    Undo the per-row filters of non-interlaced PNG image data.
+    """
+    out = bytearray(height * stride)
+    prev = bytearray(stride)
+    pos = 0
+    for y in range(height):
+        ftype = data[pos]
+        row = bytearray(data[pos + 1:pos + 1 + stride])
+        pos += 1 + stride
+        if ftype == 1:
+            for i in range(bpp, stride):
+                row[i] = (row[i] + row[i - bpp]) & 0xFF
+        elif ftype == 2:
+            row = bytearray((a + b) & 0xFF for a, b in zip(row, prev))
+        elif ftype == 3:
+            for i in range(stride):
+                left = row[i - bpp] if i >= bpp else 0
+                row[i] = (row[i] + ((left + prev[i]) >> 1)) & 0xFF
+        elif ftype == 4:
+            for i in range(stride):
+                left = row[i - bpp] if i >= bpp else 0
+                up_left = prev[i - bpp] if i >= bpp else 0
+                row[i] = (row[i] + _paeth(left, prev[i], up_left)) & 0xFF
+        elif ftype != 0:
+            raise ValueError(f'unknown PNG filter type {ftype}')
+        out[y * stride:(y + 1) * stride] = row
+        prev = row
+    return out
+
+
+def readPNG(file_path: str) -> tuple[int, int, bytearray]:
+    """
+    Read a non-interlaced PNG of any colour type into 8-bit RGBA pixels.
+    Returns the width, height and pixels. Raises ValueError for files that
+    cannot be read, including truncated or corrupt ones.
+    """
+    from struct import error as StructError
+    from zlib import error as ZlibError
+
+    with open(file_path, 'rb') as png_file:
+        data = png_file.read()
+    try:
+        width, height, pixels = _decodePNG(data, file_path)
+    except (StructError, ZlibError, KeyError, IndexError) as err:
+        raise ValueError(f'{file_path} is corrupt ({err})') from err
+    if len(pixels) != width * height * 4:
+        raise ValueError(f'{file_path} is truncated')
+    return width, height, pixels
+
+
+def _decodePNG(data: bytes, file_path: str) -> tuple[int, int, bytearray]:
+    """
+    Decode the content of a PNG file, see readPNG.
+    """
+    from struct import unpack
+    from zlib import decompress
+
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError(f'{file_path} is not a PNG')
+
+    pos = len(PNG_SIGNATURE)
+    header = b''
+    palette = b''
+    trns = b''
+    idat: list[bytes] = []
+    while pos + 8 <= len(data):
+        length, kind = unpack('>I4s', data[pos:pos + 8])
+        chunk = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if kind == b'IHDR':
+            header = chunk
+        elif kind == b'PLTE':
+            palette = chunk
+        elif kind == b'tRNS':
+            trns = chunk
+        elif kind == b'IDAT':
+            idat.append(chunk)
+        elif kind == b'IEND':
+            break
+
+    width, height, depth, colour, _, _, interlace = unpack('>IIBBBBB', header)
+    if interlace != 0:
+        raise ValueError(f'{file_path} is interlaced')
+    channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}[colour]
+    bits = depth * channels
+    stride = (width * bits + 7) // 8
+    raw = _unfilter(decompress(b''.join(idat)), height, stride, max(1, bits // 8))
+
+    # Samples as 8-bit values, the high byte of 16-bit ones
+    samples = bytearray()
+    if depth == 16:
+        samples = raw[0::2]
+    elif depth == 8:
+        samples = raw
+    else:
+        per_byte = 8 // depth
+        mask = (1 << depth) - 1
+        scale = 1 if colour == 3 else 255 // mask
+        for y in range(height):
+            row = raw[y * stride:(y + 1) * stride]
+            values = bytearray(((byte >> (8 - depth * (i + 1))) & mask) * scale
+                               for byte in row for i in range(per_byte))
+            samples += values[:width * channels]
+
+    pixels = bytearray(width * height * 4)
+    if colour == 6:
+        pixels[:] = samples
+    elif colour == 2:
+        pixels[0::4] = samples[0::3]
+        pixels[1::4] = samples[1::3]
+        pixels[2::4] = samples[2::3]
+        pixels[3::4] = b'\xff' * (width * height)
+        if len(trns) == 6:
+            key = bytes(trns[0::2] if depth == 16 else trns[1::2])
+            for i in range(width * height):
+                if pixels[i * 4:i * 4 + 3] == key:
+                    pixels[i * 4 + 3] = 0
+    elif colour in (0, 4):
+        gray = samples[0::channels]
+        pixels[0::4] = gray
+        pixels[1::4] = gray
+        pixels[2::4] = gray
+        if colour == 4:
+            pixels[3::4] = samples[1::2]
+        else:
+            pixels[3::4] = b'\xff' * (width * height)
+            if len(trns) == 2:
+                key = trns[1] if depth != 16 else trns[0]
+                if depth < 8:
+                    key *= 255 // ((1 << depth) - 1)
+                for i in range(width * height):
+                    if gray[i] == key:
+                        pixels[i * 4 + 3] = 0
+    else:
+        alpha = trns + b'\xff' * (256 - len(trns))
+        lookup = [palette[i * 3:i * 3 + 3] + alpha[i:i + 1] for i in range(len(palette) // 3)]
+        pixels = bytearray(b''.join(lookup[index] for index in samples))
+
+    return width, height, pixels
+
+
+def _filterRow(row: bytes, prev: bytes, bpp: int) -> bytes:
+    """
+    Filter a row with whichever PNG filter gives the smallest sum of
+    absolute differences, the usual heuristic for compressing well.
+    """
+    left = bytes(bpp) + row[:-bpp]
+    up_left = bytes(bpp) + prev[:-bpp]
+    candidates = [
+            row,
+            bytes((a - b) & 0xFF for a, b in zip(row, left)),
+            bytes((a - b) & 0xFF for a, b in zip(row, prev)),
+            bytes((a - ((b + c) >> 1)) & 0xFF for a, b, c in zip(row, left, prev)),
+            bytes((a - _paeth(b, c, d)) & 0xFF
+                  for a, b, c, d in zip(row, left, prev, up_left)),
+            ]
+    costs = [sum(v if v < 128 else 256 - v for v in candidate) for candidate in candidates]
+    best = costs.index(min(costs))
+    return bytes([best]) + candidates[best]
+
+
+def writePNG(file_path: str, width: int, height: int, pixels: bytes | bytearray,
+             level: int = 9, optimize: bool = False):
+    """
+    Write 8-bit RGBA pixels to a PNG file. With optimize, each row is
+    filtered to compress better, which is slower.
+    """
+    from struct import pack
+    from zlib import compress, crc32
+
+    def chunk(kind: bytes, body: bytes) -> bytes:
+        return pack('>I', len(body)) + kind + body + pack('>I', crc32(kind + body))
+
+    stride = width * 4
+    rows = [bytes(pixels[y * stride:(y + 1) * stride]) for y in range(height)]
+    if optimize:
+        raw = b''.join(_filterRow(row, rows[y - 1] if y > 0 else bytes(stride), 4)
+                       for y, row in enumerate(rows))
+    else:
+        raw = b''.join(b'\x00' + row for row in rows)
+    with open(file_path, 'wb') as png_file:
+        png_file.write(PNG_SIGNATURE)
+        png_file.write(chunk(b'IHDR', pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)))
+        png_file.write(chunk(b'IDAT', compress(raw, level)))
+        png_file.write(chunk(b'IEND', b''))
@@ -0,0 +1,122 @@
+# Module resolver
+
+class ModuleResolver:
+    """
+    Resolve required module names to files without asking Lua for each one.
+
+    The directories behind every template in a `package.path` style search
+    path are scanned once, and each file that a template could produce is
+    indexed under its module name. Lookups follow the same precedence as
+    `package.searchpath`: the first template in the path wins. Directories
+    in skip_dirs, such as the build output, are not scanned.
+    """
+
+    def __init__(self, search_path: str, skip_dirs: list[str] = []):
+        from os import path
+
+        # Module name -> [(template position, file path)] in path order
+        self.index: dict[str, list[tuple[int, str]]] = {}
+        # Templates without `?` match any module name if the file exists
+        self.catch_all: list[tuple[int, str]] = []
+        self.templates = [t for t in search_path.split(';') if t != '']
+        self._scanned: dict[str, list[str]] = {}
+        self._skip = {path.normpath(skip_dir) for skip_dir in skip_dirs}
+
+        for position, template in enumerate(self.templates):
+            self._indexTemplate(position, template)
+
+        for candidates in self.index.values():
+            candidates.sort()
+
+
+    def _listFiles(self, root: str) -> list[str]:
+        """
+        List the files under a directory, once per directory. Directories
+        with a `.` in their name are skipped, as no module name can map to
+        a path through them. Symlinked directories are followed, but each
+        directory is only visited once, so links to an ancestor do not loop.
+        """
+        from os import scandir, stat, path
+
+        if root in self._scanned:
+            return self._scanned[root]
+
+        files: list[str] = []
+        to_visit = [root]
+        visited: set[tuple[int, int]] = set()
+        while len(to_visit) > 0:
+            current = to_visit.pop()
+            try:
+                st = stat(current)
+                entries = list(scandir(current))
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) in visited:
+                continue
+            visited.add((st.st_dev, st.st_ino))
+            for entry in entries:
+                if entry.is_dir():
+                    if '.' not in entry.name and path.normpath(entry.path) not in self._skip:
+                        to_visit.append(entry.path)
+                else:
+                    files.append(entry.path)
+
+        self._scanned[root] = files
+        return files
+
+
+    def _indexTemplate(self, position: int, template: str):
+        """
+        Add every file a single path template can resolve to to the index.
+        """
+        from os import path
+        from re import compile, escape
+
+        if '?' not in template:
+            if path.isfile(template):
+                self.catch_all.append((position, template))
+            return
+
+        parts = template.split('?')
+        pattern = escape(parts[0]) + '(?P<name>[^.]+?)'
+        for part in parts[1:-1]:
+            pattern += escape(part) + '(?P=name)'
+        pattern += escape(parts[-1])
+        matcher = compile(pattern + '$')
+
+        root = path.dirname(parts[0]) or '.'
+        for file_path in self._listFiles(root):
+            if root == '.' and not parts[0].startswith('./'):
+                file_path = file_path[2:]
+            match = matcher.match(file_path)
+            if match is None:
+                continue
+            name = match.group('name').replace('/', '.')
+            self.index.setdefault(name, []).append((position, file_path))
+
+
+    def candidates(self, mod: str) -> list[str]:
+        """
+        Get every file a module name matches, in search order.
+        """
+        found = sorted(self.index.get(mod, []) + self.catch_all)
+        return [file_path for _, file_path in found]
+
+
+    def find(self, mod: str) -> str | None:
+        """
+        Get the file a module name resolves to, as `package.searchpath` would.
+        """
+        found = self.index.get(mod)
+        if found is None:
+            return self.catch_all[0][1] if len(self.catch_all) > 0 else None
+        if len(self.catch_all) > 0 and self.catch_all[0][0] < found[0][0]:
+            return self.catch_all[0][1]
+        return found[0][1]
+
+
+    def isAmbiguous(self, mod: str) -> bool:
+        """
+        Check whether several templates match a module name.
+        """
+        return len(self.candidates(mod)) > 1
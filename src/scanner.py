@@ -0,0 +1,96 @@
+# Lightweight require scanner
+#
+# Finds `require` calls without building an AST. Only comments, strings and
+# the `require` keyword are matched; everything else is skipped by the regex
+# engine, so a file costs roughly one pass of re.search.
+
+from re import compile, DOTALL, VERBOSE
+
+_token = compile(r'''
+    (?P<comment>--(?:\[(?P<ceq>=*)\[.*?\](?P=ceq)\]|[^\n]*))
+  | (?P<string>\[(?P<seq>=*)\[.*?\](?P=seq)\]
+        |"(?:[^"\\\n]|\\.)*"
+        |'(?:[^'\\\n]|\\.)*')
+  | (?<![\w.:])(?P<require>require)\b
+''', DOTALL | VERBOSE)
+
+_literal = compile(r'''
+    \[(?P<eq>=*)\[(?P<long>.*?)\](?P=eq)\]
+  | "(?P<dq>(?:[^"\\\n]|\\.)*)"
+  | '(?P<sq>(?:[^'\\\n]|\\.)*)'
+''', DOTALL | VERBOSE)
+
+_space = compile(r'(?:\s+|--\[(?P<eq>=*)\[.*?\](?P=eq)\]|--[^\n]*)*', DOTALL)
+
+
+def _readLiteral(lua_code: str, pos: int) -> tuple[str | None, int]:
+    """
+    Read the string literal at pos. Returns its value, or None when it is not
+    a plain literal, and the position after it.
+    """
+    match = _literal.match(lua_code, pos)
+    if match is None:
+        return None, pos
+
+    if match.group('long') is not None:
+        value = match.group('long')
+        # Lua skips a newline directly after the opening bracket
+        if value.startswith('\r\n'):
+            value = value[2:]
+        elif value.startswith('\n'):
+            value = value[1:]
+        return value, match.end()
+
+    value = match.group('dq') if match.group('dq') is not None\
+            else match.group('sq')
+    if '\\' in value:
+        # Escaped module names are not worth decoding, treat as dynamic
+        return None, match.end()
+    return value, match.end()
+
+
+def scanRequires(lua_code: str) -> tuple[list[str], list[int]]:
+    """
+    Find the modules required by a Lua source file.
+
+    Returns the statically required module names, in order of first use, and
+    the line numbers of require calls whose argument is not a plain string
+    literal (e.g. `require(name)` or `require("a." .. b)`).
+    """
+    requires: list[str] = []
+    dynamic: list[int] = []
+
+    if 'require' not in lua_code:
+        return requires, dynamic
+
+    pos = 0
+    while True:
+        match = _token.search(lua_code, pos)
+        if match is None:
+            break
+        pos = match.end()
+
+        if match.group('require') is None:
+            continue
+
+        start = match.start()
+        pos = _space.match(lua_code, pos).end()
+        parens = pos < len(lua_code) and lua_code[pos] == '('
+        if parens:
+            pos = _space.match(lua_code, pos + 1).end()
+        elif pos >= len(lua_code) or lua_code[pos] not in '"\'[':
+            # `require` used as a value rather than called
+            continue
+
+        name, pos = _readLiteral(lua_code, pos)
+        if parens and name is not None:
+            pos = _space.match(lua_code, pos).end()
+            if pos >= len(lua_code) or lua_code[pos] not in '),':
+                name = None
+
+        if name is None:
+            dynamic.append(lua_code.count('\n', 0, start) + 1)
+        elif name not in requires:
+            requires.append(name)
+
+    return requires, dynamic
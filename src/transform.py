@@ -0,0 +1,207 @@
+# Asset transforms
+
+# Bump when a transform gives different output for the same input and
+# settings, so cached outputs are not reused
+TRANSFORM_VERSION = 1
+
+
+def scaleImage(width: int, height: int, pixels: bytearray,
+               factor: float) -> tuple[int, int, bytearray]:
+    """
+    Downscale an image by a factor with a box filter. Colours are weighted by
+    alpha so transparent pixels do not darken edges.
+    """
+    new_w = max(1, round(width * factor))
+    new_h = max(1, round(height * factor))
+    out = bytearray(new_w * new_h * 4)
+
+    for y in range(new_h):
+        y0 = y * height // new_h
+        y1 = max(y0 + 1, (y + 1) * height // new_h)
+        for x in range(new_w):
+            x0 = x * width // new_w
+            x1 = max(x0 + 1, (x + 1) * width // new_w)
+            r = g = b = a = 0
+            for sy in range(y0, y1):
+                row = sy * width * 4
+                for sx in range(x0, x1):
+                    i = row + sx * 4
+                    alpha = pixels[i + 3]
+                    r += pixels[i] * alpha
+                    g += pixels[i + 1] * alpha
+                    b += pixels[i + 2] * alpha
+                    a += alpha
+            count = (y1 - y0) * (x1 - x0)
+            o = (y * new_w + x) * 4
+            if a > 0:
+                out[o:o + 4] = bytes([(r + a // 2) // a, (g + a // 2) // a,
+                                      (b + a // 2) // a, (a + count // 2) // count])
+    return new_w, new_h, out
+
+
+def premultiplyAlpha(width: int, height: int, pixels: bytearray,
+                     enabled: bool) -> tuple[int, int, bytearray]:
+    """
+    Multiply colours by alpha, for drawing with the "premultiplied" alpha
+    blend mode.
+    """
+    if not enabled:
+        return width, height, pixels
+    out = bytearray(pixels)
+    for i in range(0, len(out), 4):
+        alpha = out[i + 3]
+        if alpha != 255:
+            out[i] = (out[i] * alpha + 127) // 255
+            out[i + 1] = (out[i + 1] * alpha + 127) // 255
+            out[i + 2] = (out[i + 2] * alpha + 127) // 255
+    return width, height, out
+
+
+# Image transform steps, applied in this order. Each takes the pixels and
+# the step's setting from the [[transform]] rule.
+image_transforms = {
+        "scale": scaleImage,
+        "premultiply": premultiplyAlpha,
+        }
+
+# Settings of a [[transform]] rule other than its steps
+rule_settings = ["include", "output", "recompress"]
+
+
+def transformImage(src_path: str, cache_path: str, params: dict) -> str:
+    """
+    Apply a rule's steps to a PNG image and write the result to the cache.
+    Images are written with filtering chosen per row at the highest
+    compression level. With only recompression, the source is kept if that
+    does not make it smaller. Run in a worker process by syncTransforms.
+    """
+    from os import path, makedirs, replace, getpid
+    from shutil import copyfile
+    from png import readPNG, writePNG
+
+    width, height, pixels = readPNG(src_path)
+    for name, setting in params["steps"]:
+        width, height, pixels = image_transforms[name](width, height, pixels, setting)
+
+    makedirs(path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.{getpid()}.tmp"
+    writePNG(tmp_path, width, height, pixels, 9, params["recompress"])
+    if len(params["steps"]) == 0 and path.getsize(tmp_path) >= path.getsize(src_path):
+        copyfile(src_path, tmp_path)
+    replace(tmp_path, cache_path)
+    return cache_path
+
+
+def syncTransforms(rules: list[dict], assets: dict, source_dir: str,
+                   build_dir: str, records: dict[str, dict], mode: str,
+                   submit) -> tuple[dict, dict]:
+    """
+    Apply the [[transform]] rules to the assets matching their include
+    patterns. A rule's output (default "{path}", replacing the asset) names
+    where its result goes in the build directory, e.g. "low/{path}" for a
+    variant. Results are cached in the user cache directory by the input's
+    hash and the rule's settings, so unchanged assets are served from the
+    cache, and transforms run through submit, e.g. in the build's worker
+    pool.
+
+    Returns the assets left to copy, without those replaced, and the updated
+    records, keyed by output path.
+    """
+    from os import path, remove, rmdir, listdir
+    from json import dumps
+    from assets import compilePatterns, placeAsset
+    from manifest import hashContent, hashFile
+    from utils import getCacheDir
+
+    cache_dir = path.join(getCacheDir(), "transforms")
+    remaining = dict(assets)
+    synced: dict[str, dict] = {}
+    pending = []
+    cached = 0
+
+    for rule in rules:
+        unknown = [key for key in rule if key not in image_transforms
+                   and key not in rule_settings]
+        if len(unknown) > 0:
+            print('Unknown transform steps', *unknown, 'in rule for',
+                  *rule.get("include", []))
+            continue
+
+        patterns = compilePatterns(rule.get("include", []))
+        params = {
+                "steps": [[name, rule[name]] for name in image_transforms if name in rule],
+                "recompress": rule.get("recompress", False),
+                }
+
+        for rel_path, st in assets.items():
+            if patterns is None or not patterns.match(rel_path):
+                continue
+            out_rel = rule.get("output", "{path}").replace("{path}", rel_path)
+            if out_rel in synced:
+                continue
+            if not rel_path.lower().endswith('.png'):
+                print(f'Transforms only apply to PNG images, copying ./{source_dir}/{rel_path}')
+                continue
+            if out_rel == rel_path:
+                del remaining[rel_path]
+
+            src_path = f"./{source_dir}/{rel_path}"
+            dest_path = f"./{build_dir}/{out_rel}"
+            record = records.get(out_rel)
+            if record is not None and record["source"] == rel_path\
+                    and record["params"] == params and path.exists(dest_path)\
+                    and record["size"] == st.st_size and record["mtime"] == st.st_mtime_ns:
+                synced[out_rel] = record
+                continue
+
+            key = hashContent(dumps([TRANSFORM_VERSION, hashFile(src_path), params]).encode())
+            synced[out_rel] = {
+                    "source": rel_path,
+                    "params": params,
+                    "size": st.st_size,
+                    "mtime": st.st_mtime_ns,
+                    "key": key,
+                    }
+            if record is not None and record["key"] == key and path.exists(dest_path):
+                continue
+
+            cache_path = path.join(cache_dir, key[:2], f"{key}.png")
+            if path.exists(cache_path):
+                cached += 1
+                placeAsset(cache_path, dest_path, mode)
+                print(f'Transformed ./{source_dir}/{rel_path} (cached)')
+            else:
+                pending.append((rel_path, out_rel, dest_path,
+                                submit(transformImage, src_path, cache_path, params)))
+
+    failed = 0
+    for rel_path, out_rel, dest_path, fut in pending:
+        try:
+            placeAsset(fut.result(), dest_path, mode)
+            print(f'Transformed ./{source_dir}/{rel_path} to {dest_path}')
+        except ValueError as err:
+            print(f'Could not transform ./{source_dir}/{rel_path}: {err}')
+            failed += 1
+            del synced[out_rel]
+            if out_rel == rel_path:
+                remaining[rel_path] = assets[rel_path]
+
+    removed = 0
+    for out_rel in records:
+        if out_rel in synced:
+            continue
+        dest_path = f"./{build_dir}/{out_rel}"
+        if path.exists(dest_path):
+            remove(dest_path)
+            removed += 1
+        parent = path.dirname(dest_path)
+        while parent != f"./{build_dir}" and path.isdir(parent)\
+                and len(listdir(parent)) == 0:
+            rmdir(parent)
+            parent = path.dirname(parent)
+
+    applied = len(pending) - failed
+    print(f"Transforms: {applied} applied, {cached} from cache,",
+          f"{len(synced) - applied - cached} unchanged, {removed} removed",
+          *([f"({failed} failed)"] if failed > 0 else []))
+    return remaining, synced
@@ -6,6 +6,7 @@ def uninstallOpt(args: Namespace):
     """
     from toml import load, dump
     from shutil import rmtree
+    from lock import loadLock, saveLock
     
     modules: list[str] = args.module
 
@@ -28,6 +29,12 @@ def uninstallOpt(args: Namespace):
     with open('amor.toml', 'w') as amor_conf:
         dump(conf, amor_conf)
 
+    lock = loadLock()
+    if lock is not None:
+        for dep in to_delete:
+            lock["modules"].pop(dep, None)
+        saveLock(lock)
+
     return
 
 
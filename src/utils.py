@@ -1,76 +1,77 @@
 # Utility functions
 
-def getRepoTags(repo_url: str):
+def getRemoteRefs(repo_url: str, ttl: float = 0) -> dict:
     """
-    Get the tags of a remote repository.
+    Get the HEAD, branches and tags of a remote repository, from a single
+    `git ls-remote`. Annotated tags are peeled to the commit they point at.
+    Results are kept in the user cache and reused for ttl seconds, with
+    "cached" set on the result when they were. Raises ValueError if the
+    remote cannot be listed.
     """
+    from os import path, makedirs, replace, getpid
+    from json import load, dump
+    from time import time
     from subprocess import PIPE, run as cmd
-    res = cmd(["git", "ls-remote", "--tags", repo_url], stdout=PIPE, text=True)
-
-    out_lines = res.stdout.splitlines()
-
-    tags = [
-            line.split("refs/tags/")[-1] for line in out_lines
-            if "refs/tags/" in line and "^{}" not in line
-        ]
-    return tags
-
-
-def getRepoTagHashes(repo_url: str):
-    """
-    Get the hashes for the tagged releases of a remote repository.
-    """
-    from subprocess import PIPE, run as cmd
-    res = cmd(["git", "ls-remote", "--tags", repo_url], stdout=PIPE, text=True)
-
-    out_lines = res.stdout.splitlines()
-
-    tagHashes: dict[str, str] = {}
-    
-    for line in out_lines:
-        if "refs/tags/" not in line or "^{}" in line:
-            continue
-        
-        hash, tag = line.split('refs/tags/')
-        tagHashes[tag] = hash.replace('\t', '')
-
-    return tagHashes
-
-
-def getRepoHeads(repo_url: str):
-    """
-    Get the HEAD commits of a remote repository.
-    """
-    from subprocess import PIPE, run as cmd
-    res = cmd(['git', 'ls-remote', '--heads', repo_url], stdout=PIPE, text=True)
-
-    out_lines = res.stdout.splitlines()
-
-    for line in out_lines: print(line)
-
-    heads = [
-            line.split('refs/heads/')[0].replace('\t', '') for line in out_lines
-            if "refs/heads/" in line and "^{}" not in line
-            ]
-
-    return heads
-
-
-def getRepoHeadHash(repo_url: str):
+    from manifest import hashContent
+
+    cache_file = path.join(getCacheDir(), "refs", f"{hashContent(repo_url.encode())}.json")
+    if ttl > 0 and path.exists(cache_file):
+        try:
+            with open(cache_file, 'r') as refs_file:
+                refs = load(refs_file)
+            if refs["url"] == repo_url and 0 <= time() - refs["time"] < ttl:
+                refs["cached"] = True
+                return refs
+        except (OSError, ValueError, KeyError):
+            pass
+
+    res = cmd(["git", "ls-remote", "--symref", "--", repo_url, "HEAD", "refs/heads/*",
+               "refs/tags/*"], stdout=PIPE, stderr=PIPE, text=True)
+    if res.returncode != 0:
+        raise ValueError(f"could not list refs of {repo_url}: {res.stderr.strip()}")
+
+    refs = {"url": repo_url, "time": time(), "head": None, "head_ref": None,
+            "heads": {}, "tags": {}}
+    peeled: dict[str, str] = {}
+    for line in res.stdout.splitlines():
+        hash, ref = line.split('\t')
+        if hash.startswith('ref: '):
+            if ref == 'HEAD':
+                refs["head_ref"] = hash.removeprefix('ref: ')
+        elif ref == 'HEAD':
+            refs["head"] = hash
+        elif ref.startswith('refs/heads/'):
+            refs["heads"][ref.removeprefix('refs/heads/')] = hash
+        elif ref.startswith('refs/tags/') and ref.endswith('^{}'):
+            peeled[ref.removeprefix('refs/tags/').removesuffix('^{}')] = hash
+        elif ref.startswith('refs/tags/'):
+            refs["tags"][ref.removeprefix('refs/tags/')] = hash
+    refs["tags"].update(peeled)
+
+    # Written next to its final path and renamed into place, for concurrent
+    # installs. The cache only saves time, so failing to write it is fine.
+    try:
+        makedirs(path.dirname(cache_file), exist_ok=True)
+        tmp_file = f"{cache_file}.{getpid()}.tmp"
+        with open(tmp_file, 'w') as refs_file:
+            dump(refs, refs_file, indent=2)
+        replace(tmp_file, cache_file)
+    except OSError:
+        pass
+
+    refs["cached"] = False
+    return refs
+
+
+def getRepoUrl(repo: str) -> str:
     """
-    Get the hash for the HEAD commit of a remote repository.
+    Get the git URL of a module's repository, given as
+    `<username>/<repository>` on GitHub or as a URL, e.g. a local
+    `file://` one.
     """
-    from subprocess import PIPE, run as cmd
-    res = cmd(['git', 'ls-remote', repo_url, 'HEAD'], shell=False, stdout=PIPE,
-            text=True)
-     
-    out_lines = res.stdout.splitlines()
-
-    res.check_returncode()
-
-    head = out_lines[0].split('HEAD')[0].replace('\t', '')
-
-    return head
+    if '://' in repo:
+        return repo
+    return f"https://github.com/{repo}.git"
 
 
 def include_patterns(*patterns):
@@ -91,9 +92,10 @@ def include_patterns(*patterns):
     return _ignore_patterns
 
 
-def remove_empty_dirs(dir):
+def remove_empty_dirs(dir, log=print):
     """
-    Remove empty directories from a given base directory.
+    Remove empty directories from a given base directory, reporting each
+    through log.
     """
     from os import walk, listdir
     from shutil import rmtree
@@ -103,6 +105,36 @@ def remove_empty_dirs(dir):
         if len(listdir(sub_dir)) == 0:
             try:
                 rmtree(sub_dir)
-                print(f"Removed {sub_dir}")
+                log(f"Removed {sub_dir}")
             except Exception as err:
-                print(f"Could not delete {sub_dir} due to {err}.")
+                log(f"Could not delete {sub_dir} due to {err}.")
+
+
+def write_if_changed(file_path: str, content: str):
+    """
+    Write a text file only if its content would change. Returns whether the
+    file was written.
+    """
+    from os import path
+    if path.exists(file_path):
+        with open(file_path, 'rb') as existing:
+            if existing.read() == content.encode():
+                return False
+    with open(file_path, 'w') as out:
+        out.write(content)
+    return True
+
+
+def getCacheDir():
+    """
+    Get amor's user cache directory, shared between projects: AMOR_CACHE_DIR
+    if set, otherwise the platform's cache location.
+    """
+    from os import environ, path
+
+    if environ.get("AMOR_CACHE_DIR"):
+        return environ["AMOR_CACHE_DIR"]
+    if environ.get("LOCALAPPDATA"):
+        return path.join(environ["LOCALAPPDATA"], "amor", "cache")
+    base = environ.get("XDG_CACHE_HOME") or path.join(path.expanduser("~"), ".cache")
+    return path.join(base, "amor")
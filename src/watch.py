@@ -0,0 +1,284 @@
+# File watching
+
+class InotifyWatcher:
+    """
+    Watch directory trees and single files for changes with Linux inotify.
+    """
+
+    # inotify(7) event masks
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE\
+            | IN_DELETE
+
+    def __init__(self, dirs: list[str], files: list[str]):
+        from ctypes import CDLL
+        from ctypes.util import find_library
+        from os import path
+
+        self.libc = CDLL(find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(0)
+        if self.fd < 0:
+            raise OSError('inotify is not available')
+
+        self.dirs = dirs
+        # Watch descriptor -> directory path
+        self.watches: dict[int, str] = {}
+        # Directory path -> names of the single files watched in it
+        self.files: dict[str, set[str]] = {}
+
+        for dir in dirs:
+            if path.isdir(dir):
+                self._watchTree(dir)
+        for file in files:
+            parent, name = path.split(file)
+            self.files.setdefault(parent or '.', set()).add(name)
+            self._watch(parent or '.')
+
+
+    def _watch(self, dir: str):
+        """
+        Add an inotify watch for a single directory.
+        """
+        wd = self.libc.inotify_add_watch(self.fd, dir.encode(), self.WATCH_MASK)
+        if wd >= 0:
+            self.watches[wd] = dir
+
+
+    def _watchTree(self, root: str):
+        """
+        Add inotify watches for a directory and every directory in it.
+        """
+        from os import walk
+
+        for dir, _, _ in walk(root):
+            self._watch(dir)
+
+
+    def _read(self, timeout: float | None) -> list[tuple[str, bool]]:
+        """
+        Read the changed paths available within timeout, and whether each is
+        a directory.
+        """
+        from os import read, path
+        from select import select
+        from struct import unpack_from, calcsize
+
+        ready, _, _ = select([self.fd], [], [], timeout)
+        if len(ready) == 0:
+            return []
+
+        buffer = read(self.fd, 64 * 1024)
+        header = calcsize('iIII')
+        changes: list[tuple[str, bool]] = []
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = unpack_from('iIII', buffer, offset)
+            name = buffer[offset + header:offset + header + length]\
+                    .rstrip(b'\0').decode()
+            offset += header + length
+
+            if mask & self.IN_Q_OVERFLOW:
+                # Events were lost, report the roots so everything is checked
+                changes += [(dir, True) for dir in self.dirs]
+                continue
+            if wd not in self.watches or name == '':
+                continue
+
+            dir = self.watches[wd]
+            if dir in self.files and name not in self.files[dir]\
+                    and not any(dir == d or dir.startswith(f"{d}/") for d in self.dirs):
+                continue
+
+            changed = path.join(dir, name)
+            is_dir = bool(mask & self.IN_ISDIR)
+            if is_dir and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                self._watchTree(changed)
+            changes.append((changed, is_dir))
+        return changes
+
+
+    def wait(self, debounce: float) -> tuple[set[str], float]:
+        """
+        Block until something changes, then collect changes until none have
+        arrived for debounce seconds. Returns the changed paths, directories
+        with a trailing `/`, and the time of the first change.
+        """
+        from time import time
+
+        changes = self._read(None)
+        while len(changes) == 0:
+            changes = self._read(None)
+        first = time()
+
+        while True:
+            more = self._read(debounce)
+            if len(more) == 0:
+                break
+            changes += more
+
+        return {f"{p}/" if is_dir else p for p, is_dir in changes}, first
+
+
+    def close(self):
+        from os import close
+        close(self.fd)
+
+
+class PollingWatcher:
+    """
+    Watch directory trees and single files for changes by comparing sizes and
+    mtimes at an interval. Used where inotify is not available.
+    """
+
+    def __init__(self, dirs: list[str], files: list[str], interval: float = 0.25):
+        self.dirs = dirs
+        self.file_list = files
+        self.interval = interval
+        self.snapshot = self._snapshot()
+
+
+    def _snapshot(self) -> dict[str, tuple[int, int]]:
+        """
+        Get the size and mtime of every watched file. Directories reached
+        through symlinks are only visited once.
+        """
+        from os import scandir, stat
+
+        snapshot: dict[str, tuple[int, int]] = {}
+        to_visit = list(self.dirs)
+        visited: set[tuple[int, int]] = set()
+        while len(to_visit) > 0:
+            current = to_visit.pop()
+            try:
+                st = stat(current)
+                entries = list(scandir(current))
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) in visited:
+                continue
+            visited.add((st.st_dev, st.st_ino))
+            for entry in entries:
+                if entry.is_dir():
+                    snapshot[f"{entry.path}/"] = (0, 0)
+                    to_visit.append(entry.path)
+                else:
+                    st = entry.stat()
+                    snapshot[entry.path] = (st.st_size, st.st_mtime_ns)
+        for file in self.file_list:
+            try:
+                st = stat(file)
+            except OSError:
+                continue
+            snapshot[file] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+
+    def _poll(self) -> set[str]:
+        """
+        Get the paths that changed since the last poll.
+        """
+        snapshot = self._snapshot()
+        changes = {p for p in snapshot.keys() | self.snapshot.keys()
+                   if snapshot.get(p) != self.snapshot.get(p)}
+        self.snapshot = snapshot
+        return changes
+
+
+    def wait(self, debounce: float) -> tuple[set[str], float]:
+        """
+        Block until something changes, then collect changes until none have
+        arrived for debounce seconds. Returns the changed paths, directories
+        with a trailing `/`, and the time of the first change.
+        """
+        from os import path
+        from time import sleep, time
+
+        changes = self._poll()
+        while len(changes) == 0:
+            sleep(self.interval)
+            changes = self._poll()
+
+        # The mtime is the best guess of when the file was saved
+        saved = [path.getmtime(p) for p in changes if path.isfile(p)]
+        first = min(saved) if len(saved) > 0 else time()
+
+        while True:
+            sleep(debounce)
+            more = self._poll()
+            if len(more) == 0:
+                break
+            changes |= more
+
+        return changes, first
+
+
+    def close(self):
+        return
+
+
+def createWatcher(dirs: list[str], files: list[str]):
+    """
+    Create an inotify watcher where available, otherwise a polling watcher.
+    """
+    from sys import platform
+
+    if platform.startswith('linux'):
+        try:
+            return InotifyWatcher(dirs, files)
+        except (OSError, AttributeError):
+            pass
+    print('inotify not available, polling for changes...')
+    return PollingWatcher(dirs, files)
+
+
+def watchBuild(builder, debounce: float = 0.1, on_build=None):
+    """
+    Rebuild the project whenever its source, installed modules or amor.toml
+    change, until interrupted. on_build, if given, is called with the changed
+    paths after each successful rebuild.
+    """
+    from time import time
+
+    def roots():
+        return [f"./{builder.source_dir}", "./.amor"]
+
+    watched = roots()
+    watcher = createWatcher(watched, ["./amor.toml"])
+    print(f"Watching {', '.join(watched)} and ./amor.toml for changes...")
+
+    try:
+        while True:
+            changed, first = watcher.wait(debounce)
+            dirty: set[str] | None = changed
+
+            try:
+                if "./amor.toml" in changed:
+                    print('amor.toml changed, reloading...')
+                    if not builder.load():
+                        continue
+                    dirty = None
+                    if roots() != watched:
+                        watcher.close()
+                        watched = roots()
+                        watcher = createWatcher(watched, ["./amor.toml"])
+
+                builder.build(dirty)
+            except Exception as err:
+                print(f'Build failed: {err}')
+                continue
+
+            print(f'Rebuilt {len(changed)} change(s) in',
+                  f'{(time() - first) * 1000:.0f} ms from save')
+            if on_build is not None:
+                on_build(changed)
+    except KeyboardInterrupt:
+        print('Stopped watching')
+    finally:
+        watcher.close()
+    return
@@ -0,0 +1,29 @@
+import sys
+from os import path
+from subprocess import run
+
+MAIN = path.join(path.dirname(__file__), '..', 'src', 'main.py')
+
+
+def test_inline_defines_with_jobs(tmp_path):
+    """
+    build.defines given as an inline table reaches the worker processes.
+    """
+    (tmp_path / 'src').mkdir()
+    (tmp_path / 'src' / 'main.lua').write_text(
+            'local util = require("util")\n'
+            'if DEBUG then print("debug") end\n')
+    (tmp_path / 'src' / 'util.lua').write_text(
+            'if DEBUG then print("util") end\nreturn {}\n')
+    (tmp_path / 'amor.toml').write_text(
+            '[project]\nsource_dir = "src"\nbuild_dir = "build"\n'
+            'entry = "main.lua"\n\n'
+            '[build]\ninclude = []\noptimize = true\n'
+            'defines = { DEBUG = false }\n\n[dependencies]\n')
+
+    res = run([sys.executable, MAIN, 'build', '--jobs', '2'], cwd=tmp_path,
+              capture_output=True, text=True)
+
+    assert res.returncode == 0, res.stderr
+    assert 'debug' not in (tmp_path / 'build' / 'main.lua').read_text()
+    assert 'util' not in (tmp_path / 'build' / 'util.lua').read_text()
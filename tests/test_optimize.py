@@ -0,0 +1,142 @@
+import sys
+from os import path
+
+import pytest
+
+sys.path.insert(0, path.join(path.dirname(__file__), '..', 'src'))
+
+from build import compileFile
+
+RUNTIMES = ['luajit21', 'lua54']
+
+# Records Löve calls, so both versions can be compared by what they drew
+LOVE_STUB = """\
+calls = {}
+love = { graphics = {
+    draw = function(...) calls[#calls + 1] = table.concat({...}, ",") end,
+    getWidth = function() return 800 end,
+} }
+"""
+
+
+def emit(tmp_path, code: str, defines: dict, optimize: bool) -> str:
+    out_path = str(tmp_path / ('optimized.lua' if optimize else 'plain.lua'))
+    compileFile(code, out_path, {}, chunk_name='main.lua',
+                optimize={"defines": defines, "hoist": True} if optimize else None)
+    with open(out_path, 'r') as out:
+        return out.read()
+
+
+def run(runtime: str, code: str, defines: dict, setup: str):
+    """
+    Run a chunk with the defines as globals, returning its results and the
+    Löve calls it made.
+    """
+    from importlib import import_module
+
+    lua = import_module(f'lupa.{runtime}').LuaRuntime()
+    lua.execute(setup)
+    for name, value in defines.items():
+        lua.globals()[name] = value
+    results = lua.execute(code)
+    calls = lua.globals().calls
+    return results, list(calls.values()) if calls is not None else None
+
+
+def check(tmp_path, code: str, defines: dict = {}, setup: str = LOVE_STUB):
+    """
+    Assert the optimized chunk gives the same results as the original, and
+    return the optimized source.
+    """
+    plain = emit(tmp_path, code, defines, False)
+    optimized = emit(tmp_path, code, defines, True)
+    for runtime in RUNTIMES:
+        expected = run(runtime, plain, defines, setup)
+        assert run(runtime, optimized, {}, setup) == expected, (runtime, optimized)
+    return optimized
+
+
+@pytest.mark.parametrize('code', [
+    'local function f() return 1, 2 end return true and f()',
+    'local function f() return 1, 2 end return false or f()',
+    'local function f() return 1, 2 end return nil or f(), 3',
+    'local function f() return nil, 2 end return DEBUG and 1 or f()',
+    'local function f() return 1, 2 end return select("#", VERBOSE or f())',
+])
+def test_and_or_keep_one_value(tmp_path, code):
+    check(tmp_path, code, {"DEBUG": False, "VERBOSE": False})
+
+
+@pytest.mark.parametrize('code', [
+    'return N ^ 2, -N ^ 2, 2 ^ N',
+    'return -2 ^ 2, (-2) ^ 2, 2 ^ -1, - -2',
+    'return N * -1, 1 - N, N .. ""',
+])
+def test_negative_numbers(tmp_path, code):
+    check(tmp_path, code, {"N": -2})
+
+
+@pytest.mark.parametrize('defines', [
+    {"DEBUG": True, "LEVEL": 1},
+    {"DEBUG": False, "LEVEL": 3},
+    {"DEBUG": False, "LEVEL": 1},
+])
+def test_elseif_chain(tmp_path, defines):
+    check(tmp_path, """\
+local out = {}
+if DEBUG then
+    out[1] = "debug"
+elseif LEVEL > 2 then
+    local x = "high"
+    out[1] = x
+elseif false then
+    out[1] = "never"
+else
+    out[1] = "low"
+end
+while false do out[2] = "loop" end
+return out[1], x
+""", defines)
+
+
+@pytest.mark.parametrize('code', [
+    'local DEBUG = true if DEBUG then return 1 end return 2',
+    'local function f(DEBUG) return DEBUG end return f(5)',
+    'DEBUG = 7 return DEBUG',
+    'for DEBUG = 1, 2 do end return DEBUG',
+    'local t = { DEBUG = 1 } return t.DEBUG, DEBUG',
+])
+def test_shadowed_defines(tmp_path, code):
+    check(tmp_path, code, {"DEBUG": False})
+
+
+def test_hoisted_love_calls(tmp_path):
+    optimized = check(tmp_path, """\
+local function frame()
+    love.graphics.draw("a", 1)
+    love.graphics.draw("b", love.graphics.getWidth())
+    return math.floor(2.5) + math.floor(1.5)
+end
+return frame(), frame()
+""")
+    assert optimized.splitlines()[0].startswith('local ')
+
+
+def test_hoisted_love_guards(tmp_path):
+    # With t.modules.graphics = false, code only reaching love.graphics
+    # behind a check must not fail when the file loads
+    check(tmp_path, """\
+local function frame()
+    if love.graphics then
+        love.graphics.draw("a")
+        love.graphics.draw("b")
+    end
+    return "ok"
+end
+return frame()
+""", setup='calls = nil love = {}')
+
+
+def test_strings(tmp_path):
+    optimized = check(tmp_path, 'return "a" .. "b", \'it\\\'s\' .. "x", [==[a]]b]==], "\\n"')
+    assert "it\\'s" in optimized
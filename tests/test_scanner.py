@@ -0,0 +1,76 @@
+import sys
+from os import path
+
+import pytest
+
+sys.path.insert(0, path.join(path.dirname(__file__), '..', 'src'))
+
+from scanner import scanRequires
+
+
+@pytest.mark.parametrize('code', [
+    '--[[ require("a") ]]',
+    '--[==[\nrequire("a")\n]] still a comment ]==]',
+    '-- require("a")',
+    'local s = [[require("a")]]',
+    'local s = [=[ ]] require("a") ]=]',
+    'local s = "require(\'a\')"',
+    "local s = 'require(\"a\")'",
+    'local s = "\\" require(\'a\')"',
+])
+def test_comments_and_strings(code):
+    assert scanRequires(code + '\nrequire("b")') == (["b"], [])
+
+
+@pytest.mark.parametrize('code, name', [
+    ('require[[x]]', 'x'),
+    ('require [==[x.y]==]', 'x.y'),
+    ('require"x"', 'x'),
+    ("require 'x'", 'x'),
+    ('require ( "x" )', 'x'),
+    ('require(--[[ why ]] "x")', 'x'),
+    ('require("x", "extra")', 'x'),
+    ('require[[\nx]]', 'x'),
+])
+def test_call_forms(code, name):
+    assert scanRequires(code) == ([name], [])
+
+
+@pytest.mark.parametrize('code', [
+    'a.require("x")',
+    'obj:require("x")',
+    'local my_require = 1 my_require("x")',
+    'local r = require',
+    'local t = { require = true }',
+])
+def test_not_require_calls(code):
+    assert scanRequires(code) == ([], [])
+
+
+@pytest.mark.parametrize('code', [
+    'require("a\\46b")',
+    "require('a\\'b')",
+    'require "\\x61"',
+])
+def test_escaped_names_are_dynamic(code):
+    assert scanRequires(code) == ([], [1])
+
+
+def test_dynamic_lines():
+    code = '\n'.join([
+            'local a = require("a")',
+            '--[[',
+            'require(x .. y)',
+            ']]',
+            'local b = require(x .. y)',
+            'local c = require("c." .. name)',
+            'local d = require(',
+            '    name',
+            ')',
+            'local e = require(names[1])',
+            ])
+    assert scanRequires(code) == (["a"], [5, 6, 7, 10])
+
+
+def test_order_of_first_use():
+    assert scanRequires('require("b") require("a") require("b")') == (["b", "a"], [])